@@ -0,0 +1,470 @@
+import asyncio
+import datetime
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ssh_manager import SSHManager, ServerTarget, server_target
+from docker_manager import ContainerTarget, DockerManager, container_target
+from target_locks import TargetLeaseRegistry
+
+logger = logging.getLogger(__name__)
+
+class RunLogError(Exception):
+    """An experiment's action has run, but its ExperimentLog could not be written"""
+
+
+class StartRateLimiter:
+    """
+    Ceiling on how many experiment runs may start per second
+    
+    Runs over the limit are deferred on the event loop (no thread is held)
+    and start evenly spaced, 1/rate seconds apart.
+    
+    Args:
+        rate: Maximum starts per second, or None for no limit
+    """
+    
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.deferred = 0
+        self._next_slot = 0.0
+    
+    async def acquire(self):
+        """
+        Wait for a start slot
+        
+        Returns:
+            float: Seconds the caller was deferred
+        """
+        if not self.rate:
+            return 0.0
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + 1.0 / self.rate
+        delay = slot - now
+        if delay > 0:
+            self.deferred += 1
+            await asyncio.sleep(delay)
+        return delay
+
+
+class AsyncChaosEngine:
+    """
+    Asyncio execution engine for chaos actions and probes.
+    
+    Experiments, actions and health probes run as coroutines on a single
+    event loop thread. Waiting (probe sockets, backoff sleeps, reboot
+    recovery) happens on the loop and costs no thread at all; only the
+    blocking paramiko and docker-py calls are handed to a bounded executor,
+    and database work to a smaller one running inside an app context. Many
+    thousands of in-flight actions therefore share a handful of OS threads.
+    
+    Server and container actions run under per-target leases (see
+    TargetLeaseRegistry), so overlapping requests for the same target are
+    deduplicated or serialized rather than racing each other.
+    
+    Synchronous callers use run() (or submit() for fire-and-forget); the
+    coroutines must not be awaited from other event loops.
+    """
+    
+    # Server actions whose outage is measured by the recovery watcher, mapped
+    # to whether the host is expected to come back on its own
+    RECOVERY_TRACKED_ACTIONS = {'restart': True, 'stop': False}
+    
+    # Container actions: DockerManager method and the status a successful run leaves
+    CONTAINER_ACTIONS = {
+        'stop': ('stop_container', 'stopped'),
+        'start': ('start_container', 'running'),
+        'restart': ('restart_container', 'running'),
+    }
+    
+    def __init__(self, ssh_manager=None, docker_manager=None, target_locks=None, blocking_workers=32, db_workers=4,
+                 command_timeout=60):
+        self.ssh_manager = ssh_manager or SSHManager()
+        self.docker_manager = docker_manager or DockerManager()
+        self.target_locks = target_locks or TargetLeaseRegistry()
+        self.start_limiter = StartRateLimiter()
+        self.blocking_workers = blocking_workers
+        self.db_workers = db_workers
+        self.command_timeout = command_timeout
+        
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._blocking_executor = None
+        self._db_executor = None
+    
+    # Lifecycle
+    
+    def configure(self, config):
+        """
+        Apply execution limits from the Flask config
+        
+        Args:
+            config: app.config
+        """
+        self.command_timeout = config.get('SSH_COMMAND_TIMEOUT') or self.command_timeout
+        self.start_limiter.rate = config.get('SCHEDULER_MAX_STARTS_PER_SECOND')
+    
+    def start(self):
+        """Start the event loop thread if it is not already running"""
+        with self._lock:
+            if self._loop is not None:
+                return
+            self._blocking_executor = ThreadPoolExecutor(self.blocking_workers, thread_name_prefix='chaos-io')
+            self._db_executor = ThreadPoolExecutor(self.db_workers, thread_name_prefix='chaos-db')
+            
+            loop = asyncio.new_event_loop()
+            started = threading.Event()
+            
+            def run():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(started.set)
+                loop.run_forever()
+            
+            self._thread = threading.Thread(target=run, name='chaos-engine', daemon=True)
+            self._thread.start()
+            started.wait()
+            self._loop = loop
+            logger.info("Async chaos engine started")
+    
+    def stop(self):
+        """Stop the event loop; pending coroutines are cancelled"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+            if loop is None:
+                return
+            
+            def shutdown():
+                for task in asyncio.all_tasks(loop):
+                    task.cancel()
+                loop.stop()
+            
+            loop.call_soon_threadsafe(shutdown)
+            self._thread.join(timeout=5)
+            self._blocking_executor.shutdown(wait=False, cancel_futures=True)
+            self._db_executor.shutdown(wait=False, cancel_futures=True)
+            logger.info("Async chaos engine stopped")
+    
+    def submit(self, coro):
+        """
+        Schedule a coroutine on the engine loop without waiting for it
+        
+        Args:
+            coro: Coroutine object
+            
+        Returns:
+            concurrent.futures.Future
+        """
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+    
+    def run(self, coro, timeout=None):
+        """
+        Run a coroutine on the engine loop and wait for its result
+        
+        Args:
+            coro: Coroutine object
+            timeout: Seconds to wait before raising TimeoutError
+            
+        Returns:
+            The coroutine's result
+        """
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("AsyncChaosEngine.run() called from the engine loop; await the coroutine instead")
+        return self.submit(coro).result(timeout)
+    
+    async def blocking(self, fn, *args):
+        """Run a blocking library call on the bounded I/O executor"""
+        return await asyncio.get_running_loop().run_in_executor(self._blocking_executor, fn, *args)
+    
+    async def db_call(self, fn, *args):
+        """Run a database callable inside an app context on the DB executor"""
+        # Imported here to avoid circular imports
+        from app import app, db
+        
+        def call():
+            with app.app_context():
+                try:
+                    return fn(*args)
+                except Exception:
+                    db.session.rollback()
+                    raise
+        
+        return await asyncio.get_running_loop().run_in_executor(self._db_executor, call)
+    
+    # Actions
+    
+    async def server_action(self, target, action, conflict_policy=None):
+        """
+        Execute an action on a server under its lease
+        
+        Args:
+            target: ServerTarget (see ssh_manager.server_target)
+            action: 'stop', 'start', or 'restart'
+            conflict_policy: 'queue' or 'reject' when the server is busy with
+                             another action (defaults to the registry's)
+            
+        Returns:
+            dict: {'success': bool, 'message': str}, plus 'started_at' (monotonic
+                  time the fault was issued) for recovery-tracked actions. A
+                  request that joined an identical in-flight one gets
+                  'deduplicated': True and no 'started_at'.
+        """
+        _require_target(target, ServerTarget)
+        return await self.target_locks.run(
+            'server', target.id, action,
+            lambda: self._server_action(target, action),
+            conflict_policy=conflict_policy
+        )
+    
+    async def _server_action(self, target, action):
+        started_at = time.monotonic()
+        
+        if action == 'stop':
+            result = await self.blocking(self.ssh_manager.shutdown_server, target, self.command_timeout)
+        elif action == 'start':
+            # TODO: Implement Wake-on-LAN or IPMI for starting servers
+            return {'success': False, 'message': 'Server start not implemented yet. Requires Wake-on-LAN or IPMI.'}
+        elif action == 'restart':
+            result = await self.blocking(self.ssh_manager.reboot_server, target, self.command_timeout)
+        else:
+            return {'success': False, 'message': f'Unknown server action: {action}'}
+        
+        if result['success'] and action in self.RECOVERY_TRACKED_ACTIONS:
+            result['started_at'] = started_at
+        return result
+    
+    async def container_action(self, target, action, conflict_policy=None):
+        """
+        Execute an action on a container under its lease
+        
+        Args:
+            target: ContainerTarget (see docker_manager.container_target)
+            action: 'stop', 'start', or 'restart'
+            conflict_policy: 'queue' or 'reject' when the container is busy
+                             with another action (defaults to the registry's)
+            
+        Returns:
+            dict: {'success': bool, 'message': str}
+        """
+        if action not in self.CONTAINER_ACTIONS:
+            return {'success': False, 'message': f'Unknown container action: {action}'}
+        
+        _require_target(target, ContainerTarget)
+        method, _ = self.CONTAINER_ACTIONS[action]
+        return await self.target_locks.run(
+            'container', target.id, action,
+            lambda: self.blocking(getattr(self.docker_manager, method), target),
+            conflict_policy=conflict_policy
+        )
+    
+    async def container_actions(self, targets, action, parallelism=5):
+        """
+        Execute an action on many containers, at most `parallelism` at a time
+        
+        Args:
+            targets: ContainerTargets
+            action: 'stop', 'start', or 'restart'
+            parallelism: Maximum number of containers acted on at once
+            
+        Returns:
+            list: Result dicts, in the same order as targets
+        """
+        for target in targets:
+            _require_target(target, ContainerTarget)
+        semaphore = asyncio.Semaphore(max(1, parallelism))
+        
+        async def limited(target):
+            async with semaphore:
+                try:
+                    return await self.container_action(target, action)
+                except Exception as e:
+                    logger.error(f"Error executing {action} on container {target.name}: {str(e)}")
+                    return {'success': False, 'message': str(e)}
+        
+        return await asyncio.gather(*(limited(target) for target in targets))
+    
+    async def probe(self, target, level='banner', timeout=None):
+        """
+        Probe a server without holding a thread for TCP and banner tiers
+        
+        Same tiers and result shape as SSHManager.probe_server; the 'auth'
+        tier falls back to a pooled SSH login on the I/O executor.
+        
+        Args:
+            target: ServerTarget (see ssh_manager.server_target)
+            level: Deepest tier to run ('tcp', 'banner' or 'auth')
+            timeout: Per-tier timeout in seconds
+            
+        Returns:
+            dict: {'status', 'level', 'latency', 'error'}
+        """
+        _require_target(target, ServerTarget)
+        if level == 'auth':
+            return await self.blocking(self.ssh_manager.probe_server, target, level, timeout)
+        timeout = timeout or self.ssh_manager.probe_timeout
+        
+        result = {'status': 'offline', 'level': None, 'latency': {}, 'error': None}
+        writer = None
+        try:
+            started = time.monotonic()
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(target.hostname, target.port), timeout
+            )
+            result['latency']['tcp'] = round((time.monotonic() - started) * 1000, 2)
+            result['level'] = 'tcp'
+            
+            if level == 'banner':
+                started = time.monotonic()
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), timeout)
+                    if not line:
+                        raise EOFError('Connection closed before SSH banner')
+                    if line.startswith(b'SSH-'):
+                        break
+                result['latency']['banner'] = round((time.monotonic() - started) * 1000, 2)
+                result['level'] = 'banner'
+                result['banner'] = line.decode('ascii', errors='replace').strip()
+            
+            result['status'] = 'online'
+        except Exception as e:
+            result['error'] = str(e) or e.__class__.__name__
+        finally:
+            if writer is not None:
+                writer.close()
+        return result
+    
+    async def execute_experiment(self, experiment_id):
+        """
+        Execute a scheduled experiment
+        
+        Args:
+            experiment_id: ID of the Experiment row
+            
+        Returns:
+            int: ID of the ExperimentLog written, or None if the experiment is gone
+            
+        Raises:
+            RunLogError: The action ran but its log could not be written; the
+                         run must not be retried
+        """
+        plan = await self.db_call(_load_plan, experiment_id)
+        if plan is None:
+            logger.warning(f"Experiment {experiment_id} no longer exists, skipping run")
+            return None
+        
+        deferred = await self.start_limiter.acquire()
+        if deferred > 1:
+            logger.info(f"Deferred experiment {plan['name']} by {deferred:.1f}s (start rate limit)")
+        logger.info(f"Executing experiment: {plan['name']}")
+        
+        try:
+            if plan['error']:
+                result = {'success': False, 'message': plan['error']}
+            elif plan['target_type'] == 'server':
+                result = await self.server_action(plan['target'], plan['action'])
+            else:
+                result = await self.container_action(plan['target'], plan['action'])
+        except Exception as e:
+            logger.error(f"Error executing experiment {plan['name']}: {str(e)}")
+            result = {'success': False, 'message': str(e)}
+        
+        # Imported here to avoid circular imports
+        from log_store import log_sink
+        
+        # The log and status change are batched with other runs' by the log sink;
+        # submit() may block when the sink is backed up, so keep it off the loop.
+        # The action has already run, so failures here must not cause a retry
+        try:
+            row, target_status = _run_log(plan, result)
+            pending = await self.blocking(log_sink.submit, row, target_status)
+            log_id = await asyncio.wrap_future(pending)
+        except Exception as e:
+            logger.error(f"Could not log run of experiment {plan['name']}: {str(e)}")
+            raise RunLogError(f"Action ran but its log could not be written: {str(e)}") from e
+        
+        if 'started_at' in result:
+            # Imported here to avoid circular imports
+            from recovery_watcher import recovery_watcher
+            recovery_watcher.watch(
+                log_id,
+                plan['target'],
+                started_at=result['started_at'],
+                expect_recovery=self.RECOVERY_TRACKED_ACTIONS[plan['action']]
+            )
+        return log_id
+
+
+def _require_target(target, target_type):
+    """Reject ORM rows: coroutines run on the loop thread, where lazy loads through the caller's session must not happen"""
+    if not isinstance(target, target_type):
+        raise TypeError(f"Expected a {target_type.__name__}, got {type(target).__name__}")
+
+
+def _load_plan(experiment_id):
+    """Snapshot an experiment and its target for execution off the ORM session"""
+    from app import db
+    from models import Container, Experiment, Server
+    
+    experiment = db.session.get(Experiment, experiment_id)
+    if experiment is None:
+        return None
+    
+    plan = {
+        'experiment_id': experiment.id,
+        'name': experiment.name,
+        'target_type': experiment.target_type,
+        'target_id': experiment.target_id,
+        'action': experiment.action,
+        'target': None,
+        'target_name': 'Unknown',
+        'error': None
+    }
+    
+    if experiment.target_type == 'server':
+        server = db.session.get(Server, experiment.target_id)
+        if server is None:
+            plan['error'] = 'Server not found'
+        else:
+            plan['target'] = server_target(server)
+            plan['target_name'] = server.name
+    elif experiment.target_type == 'container':
+        container = db.session.get(Container, experiment.target_id)
+        if container is None:
+            plan['error'] = 'Container not found'
+        else:
+            plan['target'] = container_target(container)
+            plan['target_name'] = container.name
+    else:
+        plan['error'] = f'Unknown target type: {experiment.target_type}'
+    return plan
+
+
+def _run_log(plan, result):
+    """Build the ExperimentLog row and target status change for a run"""
+    target_status = None
+    if result['success'] and plan['target'] is not None:
+        if plan['target_type'] == 'server' and plan['action'] == 'stop':
+            target_status = ('server', plan['target_id'], 'offline')
+        elif plan['target_type'] == 'container':
+            target_status = ('container', plan['target_id'], AsyncChaosEngine.CONTAINER_ACTIONS[plan['action']][1])
+    
+    row = {
+        'experiment_id': plan['experiment_id'],
+        'target_type': plan['target_type'],
+        'target_id': plan['target_id'],
+        'target_name': plan['target_name'],
+        'action': plan['action'],
+        'status': 'success' if result['success'] else 'failure',
+        'details': result['message'],
+        'recovery_status': 'pending' if 'started_at' in result else None,
+        'execution_time': datetime.datetime.utcnow()
+    }
+    return row, target_status
+
+
+# Process-wide engine shared by ChaosManager, the scheduler and the recovery watcher
+engine = AsyncChaosEngine()
@@ -1,27 +1,48 @@
+import datetime
 import logging
-from ssh_manager import SSHManager
-from docker_manager import DockerManager
+import math
+import random
+from sqlalchemy.orm import joinedload
+from async_engine import AsyncChaosEngine, engine
+from docker_manager import container_target
+from log_store import insert_logs
+from recovery_watcher import recovery_watcher
+from ssh_manager import server_target
 from app import db
-from models import Server, Container, ExperimentLog
+from models import Container, ExperimentLog, Server
 
 logger = logging.getLogger(__name__)
 
 class ChaosManager:
     """
     Central manager for executing chaos experiments on servers and containers
+    
+    A synchronous facade over the AsyncChaosEngine: the remote work runs on
+    the engine's event loop, while status updates on the caller's ORM
+    objects stay in the caller's session. Actions hold a per-target lease,
+    so identical concurrent requests share one execution and conflicting
+    ones queue (or are rejected) instead of racing on the same target.
     """
     
+    RECOVERY_TRACKED_ACTIONS = AsyncChaosEngine.RECOVERY_TRACKED_ACTIONS
+    CONTAINER_ACTIONS = AsyncChaosEngine.CONTAINER_ACTIONS
+    
     def __init__(self):
-        self.ssh_manager = SSHManager()
-        self.docker_manager = DockerManager()
+        self.engine = engine
+        self.ssh_manager = engine.ssh_manager
+        self.docker_manager = engine.docker_manager
+        self.target_locks = engine.target_locks
+        self.recovery_watcher = recovery_watcher
     
-    def execute_server_action(self, server, action):
+    def execute_server_action(self, server, action, conflict_policy=None):
         """
         Execute action on a server
         
         Args:
             server: Server object
             action: 'stop', 'start', or 'restart'
+            conflict_policy: 'queue' or 'reject' if the server is busy with
+                             another action (defaults to the lease registry's)
             
         Returns:
             dict: {'success': bool, 'message': str}
@@ -29,14 +50,9 @@ class ChaosManager:
         logger.info(f"Executing {action} on server {server.name} ({server.hostname})")
         
         try:
-            if action == 'stop':
-                result = self.ssh_manager.shutdown_server(server)
-                server.status = 'offline' if result['success'] else server.status
-            elif action == 'start':
-                # TODO: Implement Wake-on-LAN or IPMI for starting servers
-                return {'success': False, 'message': 'Server start not implemented yet. Requires Wake-on-LAN or IPMI.'}
-            elif action == 'restart':
-                result = self.ssh_manager.reboot_server(server)
+            result = self.engine.run(self.engine.server_action(server_target(server), action, conflict_policy))
+            if action == 'stop' and result['success']:
+                server.status = 'offline'
                 
             db.session.commit()
             return result
@@ -45,13 +61,15 @@ class ChaosManager:
             logger.error(f"Error executing {action} on server {server.name}: {str(e)}")
             return {'success': False, 'message': str(e)}
     
-    def execute_container_action(self, container, action):
+    def execute_container_action(self, container, action, conflict_policy=None):
         """
         Execute action on a container
         
         Args:
             container: Container object
             action: 'stop', 'start', or 'restart'
+            conflict_policy: 'queue' or 'reject' if the container is busy with
+                             another action (defaults to the lease registry's)
             
         Returns:
             dict: {'success': bool, 'message': str}
@@ -59,15 +77,9 @@ class ChaosManager:
         logger.info(f"Executing {action} on container {container.name} (ID: {container.container_id})")
         
         try:
-            if action == 'stop':
-                result = self.docker_manager.stop_container(container)
-                container.status = 'stopped' if result['success'] else container.status
-            elif action == 'start':
-                result = self.docker_manager.start_container(container)
-                container.status = 'running' if result['success'] else container.status
-            elif action == 'restart':
-                result = self.docker_manager.restart_container(container)
-                container.status = 'running' if result['success'] else container.status
+            result = self.engine.run(self.engine.container_action(container_target(container), action, conflict_policy))
+            if result['success']:
+                container.status = self.CONTAINER_ACTIONS[action][1]
                 
             db.session.commit()
             return result
@@ -76,70 +88,270 @@ class ChaosManager:
             logger.error(f"Error executing {action} on container {container.name}: {str(e)}")
             return {'success': False, 'message': str(e)}
     
-    def execute_experiment(self, experiment):
+    def select_containers(self, image=None, name_pattern=None, labels=None, docker_host_id=None):
         """
-        Execute a scheduled experiment
+        Find containers matching a selector
+        
+        Image and name patterns are shell-style globs (e.g. 'api-*'). Label
+        selectors match on key=value, or on key presence when the value is None.
         
         Args:
-            experiment: Experiment object
+            image: Image glob
+            name_pattern: Container name glob
+            labels: dict of label key -> value (or None)
+            docker_host_id: Restrict to one Docker host
             
         Returns:
-            ExperimentLog: Log of the experiment execution
+            list: Container objects, with docker_host loaded
         """
-        logger.info(f"Executing experiment: {experiment.name}")
+        query = Container.query.options(joinedload(Container.docker_host))
+        if docker_host_id is not None:
+            query = query.filter(Container.docker_host_id == docker_host_id)
+        if image:
+            query = query.filter(Container.image.like(_glob_to_like(image), escape='\\'))
+        if name_pattern:
+            query = query.filter(Container.name.like(_glob_to_like(name_pattern), escape='\\'))
+        containers = query.order_by(Container.id).all()
         
-        try:
-            # Determine target and action
-            if experiment.target_type == 'server':
-                server = Server.query.get(experiment.target_id)
-                if not server:
-                    return self._create_error_log(experiment, 'Server not found')
-                
-                target_name = server.name
-                result = self.execute_server_action(server, experiment.action)
-                
-            elif experiment.target_type == 'container':
-                container = Container.query.get(experiment.target_id)
-                if not container:
-                    return self._create_error_log(experiment, 'Container not found')
-                
-                target_name = container.name
-                result = self.execute_container_action(container, experiment.action)
-                
-            else:
-                return self._create_error_log(experiment, f'Unknown target type: {experiment.target_type}')
-            
-            # Create and return log
-            log = ExperimentLog(
-                experiment_id=experiment.id,
-                target_type=experiment.target_type,
-                target_id=experiment.target_id,
-                target_name=target_name,
-                action=experiment.action,
-                status='success' if result['success'] else 'failure',
-                details=result['message']
-            )
+        if labels:
+            containers = [
+                container for container in containers
+                if all(
+                    key in container_labels and (value is None or container_labels[key] == value)
+                    for container_labels in [container.get_labels()]
+                    for key, value in labels.items()
+                )
+            ]
+        return containers
+    
+    def execute_bulk_container_action(self, containers, action, parallelism=5, percentage=100, experiment_id=None):
+        """
+        Execute an action on a random share of containers, several at a time
+        
+        Docker calls run on the async engine, `parallelism` at a time. Status updates
+        and one ExperimentLog row per container are then written in a single
+        transaction, the logs as one bulk insert.
+        
+        Args:
+            containers: Candidate Container objects (see select_containers)
+            action: 'stop', 'start', or 'restart'
+            parallelism: Maximum number of containers acted on at once
+            percentage: Share of the candidates to hit, 0-100 (rounded up)
+            experiment_id: Experiment to attribute the logs to, if any
             
-            db.session.add(log)
-            db.session.commit()
-            return log
+        Returns:
+            dict: {'success': bool, 'message': str, 'matched': int,
+                   'selected': int, 'succeeded': int, 'failed': int,
+                   'results': list of per-container dicts}
+        """
+        if action not in self.CONTAINER_ACTIONS:
+            return {'success': False, 'message': f'Unknown container action: {action}'}
+        if not 0 < percentage <= 100:
+            return {'success': False, 'message': 'Percentage must be between 0 and 100'}
+        
+        matched = len(containers)
+        count = min(matched, math.ceil(matched * percentage / 100))
+        targets = random.sample(containers, count)
+        logger.info(f"Executing {action} on {count} of {matched} matching containers, {parallelism} at a time")
+        
+        status = self.CONTAINER_ACTIONS[action][1]
+        # Snapshot the rows here: the engine runs on its own loop thread
+        results = self.engine.run(
+            self.engine.container_actions([container_target(container) for container in targets], action, parallelism)
+        ) if targets else []
+        
+        now = datetime.datetime.utcnow()
+        rows = []
+        for container, result in zip(targets, results):
+            if result['success']:
+                container.status = status
+            rows.append({
+                'experiment_id': experiment_id,
+                'target_type': 'container',
+                'target_id': container.id,
+                'target_name': container.name,
+                'action': action,
+                'status': 'success' if result['success'] else 'failure',
+                'details': result['message'],
+                'execution_time': now
+            })
+        
+        insert_logs(rows)
+        db.session.commit()
+        
+        succeeded = sum(1 for result in results if result['success'])
+        return {
+            'success': succeeded == count,
+            'message': f'{action} succeeded on {succeeded} of {count} containers ({matched} matched)',
+            'matched': matched,
+            'selected': count,
+            'succeeded': succeeded,
+            'failed': count - succeeded,
+            'results': [
+                {'container_id': container.id, 'name': container.name,
+                 'success': result['success'], 'message': result['message']}
+                for container, result in zip(targets, results)
+            ]
+        }
+    
+    def select_servers(self, name_pattern=None, hostname_pattern=None):
+        """
+        Find servers matching a selector
+        
+        Args:
+            name_pattern: Server name glob (e.g. 'web-*')
+            hostname_pattern: Hostname glob (e.g. '10.0.1.*')
             
-        except Exception as e:
-            logger.error(f"Error executing experiment {experiment.name}: {str(e)}")
-            return self._create_error_log(experiment, str(e))
+        Returns:
+            list: Server objects
+        """
+        query = Server.query
+        if name_pattern:
+            query = query.filter(Server.name.like(_glob_to_like(name_pattern), escape='\\'))
+        if hostname_pattern:
+            query = query.filter(Server.hostname.like(_glob_to_like(hostname_pattern), escape='\\'))
+        return query.order_by(Server.id).all()
     
-    def _create_error_log(self, experiment, error_message):
-        """Helper to create an error log entry"""
-        log = ExperimentLog(
-            experiment_id=experiment.id,
-            target_type=experiment.target_type,
-            target_id=experiment.target_id,
-            target_name='Unknown',
-            action=experiment.action,
-            status='failure',
-            details=error_message
-        )
+    def execute_bulk_server_action(self, servers, action, parallelism=5, percentage=100, experiment_id=None):
+        """
+        Execute an action on a random share of servers, several at a time
+        
+        Hosts are driven through SSHManager.run_batch, each under its lease
+        on the async engine. Status updates and one ExperimentLog row per
+        server are then written in a single transaction, and successful
+        faults are handed to the recovery watcher.
         
-        db.session.add(log)
+        Args:
+            servers: Candidate Server objects (see select_servers)
+            action: 'stop', 'start', or 'restart'
+            parallelism: Maximum number of servers acted on at once
+            percentage: Share of the candidates to hit, 0-100 (rounded up)
+            experiment_id: Experiment to attribute the logs to, if any
+            
+        Returns:
+            dict: {'success': bool, 'message': str, 'matched': int,
+                   'selected': int, 'succeeded': int, 'failed': int,
+                   'results': list of per-server dicts with 'elapsed'}
+        """
+        if action not in ('stop', 'start', 'restart'):
+            return {'success': False, 'message': f'Unknown server action: {action}'}
+        if not 0 < percentage <= 100:
+            return {'success': False, 'message': 'Percentage must be between 0 and 100'}
+        
+        matched = len(servers)
+        count = min(matched, math.ceil(matched * percentage / 100))
+        targets = random.sample(servers, count)
+        logger.info(f"Executing {action} on {count} of {matched} matching servers, {parallelism} at a time")
+        
+        # run_batch yields in completion order; put the results back in target order
+        finished = {
+            result['server_id']: result
+            for result in self.ssh_manager.run_batch(
+                targets,
+                lambda target: self.engine.run(self.engine.server_action(target, action)),
+                max_workers=max(1, parallelism)
+            )
+        }
+        results = [finished[server.id] for server in targets]
+        
+        now = datetime.datetime.utcnow()
+        rows = []
+        for server, result in zip(targets, results):
+            if action == 'stop' and result['success']:
+                server.status = 'offline'
+            rows.append({
+                'experiment_id': experiment_id,
+                'target_type': 'server',
+                'target_id': server.id,
+                'target_name': server.name,
+                'action': action,
+                'status': 'success' if result['success'] else 'failure',
+                'details': result['message'],
+                'recovery_status': 'pending' if 'started_at' in result else None,
+                'execution_time': now
+            })
+        
+        log_ids = insert_logs(rows, return_ids=True)
         db.session.commit()
-        return log
+        
+        for server, result, log_id in zip(targets, results, log_ids):
+            if 'started_at' in result:
+                self.recovery_watcher.watch(
+                    log_id,
+                    server,
+                    started_at=result['started_at'],
+                    expect_recovery=self.RECOVERY_TRACKED_ACTIONS[action]
+                )
+        
+        succeeded = sum(1 for result in results if result['success'])
+        return {
+            'success': succeeded == count,
+            'message': f'{action} succeeded on {succeeded} of {count} servers ({matched} matched)',
+            'matched': matched,
+            'selected': count,
+            'succeeded': succeeded,
+            'failed': count - succeeded,
+            'results': [
+                {'server_id': server.id, 'name': server.name, 'success': result['success'],
+                 'message': result['message'], 'elapsed': result['elapsed']}
+                for server, result in zip(targets, results)
+            ]
+        }
+    
+    def execute_experiment(self, experiment):
+        """
+        Execute a scheduled experiment
+        
+        The experiment and its target are reloaded in a fresh session on the
+        engine; the resulting log is then loaded in the caller's session, so
+        an app context is required.
+        
+        Args:
+            experiment: Experiment object
+            
+        Returns:
+            ExperimentLog: Log of the execution, or None if the experiment
+                           no longer exists
+        """
+        log_id = self.engine.run(self.engine.execute_experiment(experiment.id))
+        if log_id is None:
+            return None
+        return db.session.get(ExperimentLog, log_id)
+    
+    def get_lock_metrics(self):
+        """
+        Get per-target lease metrics
+        
+        Returns:
+            dict: Execution, deduplication, rejection and timeout counters plus
+                  lock wait statistics in seconds
+        """
+        return self.target_locks.metrics()
+    
+    def track_recovery(self, log, server, result):
+        """
+        Hand a committed server fault log to the recovery watcher
+        
+        Does nothing unless the action succeeded and is recovery-tracked
+        (execute_server_action marks those with 'started_at').
+        
+        Args:
+            log: Committed ExperimentLog for the fault
+            server: Server object that received the fault
+            result: Result dict from execute_server_action
+        """
+        if 'started_at' not in result:
+            return
+        
+        self.recovery_watcher.watch(
+            log.id,
+            server,
+            started_at=result['started_at'],
+            expect_recovery=self.RECOVERY_TRACKED_ACTIONS[log.action]
+        )
+
+
+def _glob_to_like(pattern):
+    """Translate a shell-style glob into a SQL LIKE pattern (escape char '\\')"""
+    escaped = pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped.replace('*', '%').replace('?', '_')
@@ -0,0 +1,313 @@
+import json
+import logging
+import queue
+import threading
+import time
+from sqlalchemy import and_, delete, insert, or_, select, update
+from app import db
+from models import Container, DockerHost
+from docker_manager import DockerManager, docker_host_target
+
+logger = logging.getLogger(__name__)
+
+# Container event actions mapped to the status they leave the container in
+EVENT_STATUS = {
+    'create': 'created',
+    'start': 'running',
+    'restart': 'running',
+    'unpause': 'running',
+    'pause': 'paused',
+    'die': 'exited',
+    'stop': 'exited',
+    'kill': 'exited',
+    'oom': 'exited',
+}
+
+class DockerEventMonitor:
+    """
+    Keeps the Container table current by following each host's event stream.
+    
+    One thread per DockerHost follows the Docker events API for container
+    create/start/stop/die/destroy events and puts them on a shared queue. A
+    single applier thread drains the queue and writes changes to the
+    Container table in small batches. Streams that drop are reconnected with
+    backoff and resumed from the last event timestamp; after a long gap (or on
+    first connect) the host is resynced from a full listing instead.
+    
+    Only one process should run the monitor: the elected scheduler leader
+    starts it (see ChaosScheduler), so duplicate subscribers never race on
+    the same container rows.
+    """
+    
+    def __init__(self, docker_manager=None, batch_size=200, flush_interval=1.0,
+                 max_backoff=30, resync_after=60):
+        self.docker_manager = docker_manager or DockerManager()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.resync_after = resync_after
+        
+        self._app = None
+        self._queue = queue.Queue(maxsize=10000)
+        self._watchers = {}  # host id -> _HostWatcher
+        self._lock = threading.Lock()
+        self._applier = None
+        self._running = False
+    
+    def start(self, app):
+        """
+        Start watching every DockerHost
+        
+        Args:
+            app: Flask app, used for database access from background threads
+        """
+        with self._lock:
+            if self._running:
+                return
+            self._app = app
+            self._running = True
+            self._applier = threading.Thread(target=self._apply_loop, name='docker-events-applier', daemon=True)
+            self._applier.start()
+        
+        with app.app_context():
+            hosts = [docker_host_target(host) for host in DockerHost.query.all()]
+        for host in hosts:
+            self.watch_host(host)
+        logger.info(f"Docker event monitor started for {len(hosts)} hosts")
+    
+    def watch_host(self, host):
+        """
+        Start (or restart) following events for a host
+        
+        Args:
+            host: DockerHost object
+        """
+        if not self._running:
+            return
+        target = docker_host_target(host)
+        watcher = _HostWatcher(self, target)
+        with self._lock:
+            previous = self._watchers.get(target.id)
+            self._watchers[target.id] = watcher
+        if previous is not None:
+            previous.stop()
+        watcher.start()
+    
+    def sync_hosts(self):
+        """
+        Follow DockerHosts added, and drop those removed, since the last sync
+        
+        Picks up host changes made by other processes. Must be called inside
+        an app context.
+        """
+        if not self._running:
+            return
+        hosts = {host.id: host for host in DockerHost.query.all()}
+        with self._lock:
+            watched = set(self._watchers)
+        for host_id in watched - hosts.keys():
+            self.unwatch_host(host_id)
+        for host_id in hosts.keys() - watched:
+            self.watch_host(hosts[host_id])
+    
+    def unwatch_host(self, host_id):
+        """
+        Stop following events for a host
+        
+        Args:
+            host_id: ID of the DockerHost row
+        """
+        with self._lock:
+            watcher = self._watchers.pop(host_id, None)
+        if watcher is not None:
+            watcher.stop()
+    
+    def stop(self):
+        """Stop all watchers and the applier thread"""
+        with self._lock:
+            self._running = False
+            watchers = list(self._watchers.values())
+            self._watchers.clear()
+        for watcher in watchers:
+            watcher.stop()
+    
+    def _apply_loop(self):
+        while self._running:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self._apply(batch)
+                except Exception as e:
+                    logger.error(f"Error applying {len(batch)} Docker events: {str(e)}")
+    
+    def _apply(self, batch):
+        with self._app.app_context():
+            changes = {}  # (host id, container id) -> latest change
+            for item in batch:
+                if item[0] == 'resync':
+                    _, host, summaries = item
+                    counts = self.docker_manager.sync_containers(host, summaries)
+                    # Events queued before the listing are superseded by it
+                    changes = {key: change for key, change in changes.items() if key[0] != host.id}
+                    logger.info(f"Resynced containers for {host.url}: {counts}")
+                    continue
+                _, host_id, container_id, change = item
+                merged = changes.setdefault((host_id, container_id), {})
+                merged.update(change)
+            
+            if changes:
+                self._apply_changes(changes)
+            db.session.commit()
+    
+    @staticmethod
+    def _apply_changes(changes):
+        keys = list(changes)
+        existing = {
+            (row.docker_host_id, row.container_id): row.id
+            for row in db.session.execute(
+                select(Container.id, Container.docker_host_id, Container.container_id).where(or_(*[
+                    and_(Container.docker_host_id == host_id, Container.container_id == container_id)
+                    for host_id, container_id in keys
+                ]))
+            )
+        }
+        
+        inserts, updates, removed = [], [], []
+        for key, change in changes.items():
+            row_id = existing.get(key)
+            if change.get('destroyed'):
+                if row_id is not None:
+                    removed.append(row_id)
+                continue
+            if row_id is None:
+                inserts.append({
+                    'docker_host_id': key[0],
+                    'container_id': key[1],
+                    'name': change.get('name') or key[1][:12],
+                    'image': change.get('image') or '',
+                    'status': change.get('status') or 'unknown',
+                    'labels': change.get('labels')
+                })
+            else:
+                values = {column: change[column] for column in ('name', 'image', 'status', 'labels') if column in change}
+                if values:
+                    updates.append(dict(values, id=row_id))
+        
+        if inserts:
+            db.session.execute(insert(Container), inserts)
+        # Bulk UPDATE by primary key needs the same columns in every row
+        for columns in {tuple(sorted(row)) for row in updates}:
+            db.session.execute(update(Container), [row for row in updates if tuple(sorted(row)) == columns])
+        if removed:
+            db.session.execute(
+                delete(Container).where(Container.id.in_(removed)),
+                execution_options={'synchronize_session': False}
+            )
+
+
+class _HostWatcher:
+    """Follows the event stream of one Docker host on its own thread"""
+    
+    def __init__(self, monitor, host):
+        self.monitor = monitor
+        self.host = host
+        self.since = None
+        self.disconnected_at = None
+        self._stream = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'docker-events-{host.id}', daemon=True)
+    
+    def start(self):
+        self._thread.start()
+    
+    def stop(self):
+        self._stopped.set()
+        stream = self._stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception as e:
+                logger.debug(f"Error closing event stream for {self.host.url}: {str(e)}")
+    
+    def _run(self):
+        backoff = 1
+        while not self._stopped.is_set():
+            try:
+                self._follow()
+                backoff = 1
+            except Exception as e:
+                if self._stopped.is_set():
+                    break
+                logger.warning(f"Docker event stream for {self.host.url} dropped: {str(e)}")
+                self.monitor.docker_manager.clients.invalidate(self.host.id)
+            
+            if self.disconnected_at is None:
+                self.disconnected_at = time.time()
+            self._stopped.wait(backoff)
+            backoff = min(backoff * 2, self.monitor.max_backoff)
+    
+    def _follow(self):
+        client = self.monitor.docker_manager.get_docker_client(self.host)
+        
+        gap = time.time() - self.disconnected_at if self.disconnected_at else None
+        if self.since is None or (gap is not None and gap > self.monitor.resync_after):
+            # Missed too much (or never synced); start from a full listing
+            listed_at = int(time.time())
+            summaries = self.monitor.docker_manager.list_containers(self.host)
+            self.monitor._queue.put(('resync', self.host, summaries))
+            self.since = listed_at
+        
+        self._stream = client.events(since=self.since, filters={'type': 'container'}, decode=True)
+        self.disconnected_at = None
+        logger.debug(f"Following Docker events for {self.host.url} since {self.since}")
+        
+        try:
+            for event in self._stream:
+                if self._stopped.is_set():
+                    return
+                self._handle(event)
+        finally:
+            self._stream = None
+        
+        # The daemon closed the stream
+        self.disconnected_at = time.time()
+    
+    def _handle(self, event):
+        action = (event.get('Action') or event.get('status') or '').split(':')[0]
+        actor = event.get('Actor') or {}
+        container_id = actor.get('ID') or event.get('id')
+        attributes = actor.get('Attributes') or {}
+        
+        if event.get('time'):
+            self.since = event['time']
+        if not container_id:
+            return
+        
+        if action == 'destroy':
+            change = {'destroyed': True}
+        elif action == 'rename':
+            change = {'name': attributes.get('name')}
+        elif action in EVENT_STATUS:
+            change = {'status': EVENT_STATUS[action]}
+            if action == 'create':
+                # Create events carry the container's labels alongside name and image
+                labels = {key: value for key, value in attributes.items() if key not in ('name', 'image')}
+                change.update(
+                    name=attributes.get('name'),
+                    image=attributes.get('image') or event.get('from'),
+                    labels=json.dumps(labels, sort_keys=True) if labels else None
+                )
+        else:
+            return
+        
+        self.monitor._queue.put(('event', self.host.id, container_id, change))
+
+
+# Process-wide monitor, started and stopped by the scheduler leader when enabled
+docker_event_monitor = DockerEventMonitor()
@@ -1,18 +1,248 @@
+import datetime
 import docker
+import json
 import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from sqlalchemy import delete, event, insert, inspect, select, update
 from app import db
-from models import Container
+from models import Container, DockerHost
 
 logger = logging.getLogger(__name__)
 
+class DockerClientCache:
+    """
+    Process-wide cache of Docker clients, one per DockerHost.
+    
+    Each docker.DockerClient owns an HTTP connection pool, so reusing it
+    across actions saves a TCP (and for remote daemons, TLS) handshake per
+    call. Entries are keyed by host id and connection settings, pinged before
+    reuse once they have sat unused for health_check_interval, and closed
+    after idle_timeout.
+    """
+    
+    def __init__(self, idle_timeout=300, health_check_interval=30, sweep_interval=60):
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.sweep_interval = sweep_interval
+        
+        self._lock = threading.Lock()
+        self._clients = {}  # host id -> _CachedClient
+        self._last_sweep = time.monotonic()
+    
+    @staticmethod
+    def cache_key(host):
+        """
+        Connection settings a cached client was built from
+        
+        Args:
+            host: DockerHost object
+            
+        Returns:
+            tuple
+        """
+        return (host.url, bool(host.tls_verify), host.cert_path)
+    
+    def get(self, host, create):
+        """
+        Get a healthy client for the host, creating one if needed
+        
+        Args:
+            host: DockerHost object
+            create: Callable creating a new docker.DockerClient for the host
+            
+        Returns:
+            docker.DockerClient
+        """
+        # Hosts not yet saved (e.g. connection tests) are never cached
+        if host.id is None:
+            return create(host)
+        
+        self._maybe_sweep()
+        key = self.cache_key(host)
+        
+        with self._lock:
+            cached = self._clients.get(host.id)
+            if cached is not None and cached.key != key:
+                # The host row was edited since the client was created
+                del self._clients[host.id]
+                self._close(cached.client)
+                cached = None
+        
+        if cached is not None:
+            now = time.monotonic()
+            if now - cached.last_used < self.health_check_interval or self._ping(cached.client):
+                cached.last_used = now
+                return cached.client
+            logger.info(f"Cached Docker client for {host.url} failed health check, reconnecting")
+            self._discard(host.id, cached)
+        
+        client = create(host)
+        with self._lock:
+            existing = self._clients.get(host.id)
+            if existing is not None and existing.key == key:
+                # Another thread created one first; keep theirs
+                self._close(client)
+                existing.last_used = time.monotonic()
+                return existing.client
+            self._clients[host.id] = _CachedClient(client, key)
+        return client
+    
+    def invalidate(self, host_id):
+        """
+        Close and forget the cached client for a host
+        
+        Args:
+            host_id: ID of the DockerHost row
+        """
+        with self._lock:
+            cached = self._clients.pop(host_id, None)
+        if cached is not None:
+            self._close(cached.client)
+    
+    def evict_idle(self):
+        """Close clients unused for longer than idle_timeout"""
+        now = time.monotonic()
+        with self._lock:
+            stale = [host_id for host_id, cached in self._clients.items()
+                     if now - cached.last_used > self.idle_timeout]
+            clients = [self._clients.pop(host_id).client for host_id in stale]
+            self._last_sweep = now
+        for client in clients:
+            self._close(client)
+    
+    def close_all(self):
+        """Close every cached client"""
+        with self._lock:
+            clients = [cached.client for cached in self._clients.values()]
+            self._clients.clear()
+        for client in clients:
+            self._close(client)
+    
+    def _discard(self, host_id, cached):
+        with self._lock:
+            if self._clients.get(host_id) is cached:
+                del self._clients[host_id]
+        self._close(cached.client)
+    
+    def _maybe_sweep(self):
+        if time.monotonic() - self._last_sweep >= self.sweep_interval:
+            self.evict_idle()
+    
+    @staticmethod
+    def _ping(client):
+        try:
+            return client.ping()
+        except Exception as e:
+            logger.debug(f"Docker ping failed: {str(e)}")
+            return False
+    
+    @staticmethod
+    def _close(client):
+        try:
+            client.close()
+        except Exception as e:
+            logger.debug(f"Error closing Docker client: {str(e)}")
+
+
+class _CachedClient:
+    __slots__ = ('client', 'key', 'last_used')
+    
+    def __init__(self, client, key):
+        self.client = client
+        self.key = key
+        self.last_used = time.monotonic()
+
+
+# Process-wide cache shared by every DockerManager instance
+client_cache = DockerClientCache()
+
+# Detached copy of the DockerHost columns needed to connect, for use from
+# background threads that must not touch ORM instances
+DockerHostTarget = namedtuple('DockerHostTarget', ['id', 'name', 'url', 'tls_verify', 'cert_path'])
+
+def docker_host_target(host):
+    """
+    Snapshot the connection details of a DockerHost row
+    
+    Args:
+        host: DockerHost object (or DockerHostTarget)
+        
+    Returns:
+        DockerHostTarget
+    """
+    if isinstance(host, DockerHostTarget):
+        return host
+    return DockerHostTarget(
+        id=host.id,
+        name=host.name,
+        url=host.url,
+        tls_verify=host.tls_verify,
+        cert_path=host.cert_path
+    )
+
+@event.listens_for(DockerHost, 'after_update')
+def _docker_host_updated(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[column].history.has_changes() for column in ('url', 'tls_verify', 'cert_path')):
+        client_cache.invalidate(target.id)
+
+@event.listens_for(DockerHost, 'after_delete')
+def _docker_host_deleted(mapper, connection, target):
+    client_cache.invalidate(target.id)
+
+# Detached copy of a Container row (with its host) as needed by the container
+# actions, for use from threads that must not touch ORM instances
+ContainerTarget = namedtuple('ContainerTarget', ['id', 'container_id', 'name', 'docker_host_id', 'docker_host'])
+
+def container_target(container):
+    """
+    Snapshot the details of a Container row needed to act on it
+    
+    Args:
+        container: Container object (or ContainerTarget)
+        
+    Returns:
+        ContainerTarget
+    """
+    if isinstance(container, ContainerTarget):
+        return container
+    return ContainerTarget(
+        id=container.id,
+        container_id=container.container_id,
+        name=container.name,
+        docker_host_id=container.docker_host_id,
+        docker_host=docker_host_target(container.docker_host)
+    )
+
 class DockerManager:
     """
     Manager for Docker operations
     """
     
+    # Keeps DELETE ... WHERE id IN (...) under SQLite's bound-parameter limit
+    DELETE_BATCH_SIZE = 500
+    
+    def __init__(self, clients=None):
+        self.clients = clients or client_cache
+    
     def get_docker_client(self, host):
         """
-        Create a Docker client for the host
+        Get a cached Docker client for the host
+        
+        Args:
+            host: DockerHost object
+            
+        Returns:
+            docker.DockerClient
+        """
+        return self.clients.get(host, self.create_docker_client)
+    
+    def create_docker_client(self, host):
+        """
+        Create a new Docker client for the host
         
         Args:
             host: DockerHost object
@@ -53,6 +283,7 @@ class DockerManager:
             client.ping()
             return True
         except Exception as e:
+            self.clients.invalidate(host.id)
             logger.error(f"Failed to connect to Docker host {host.url}: {str(e)}")
             return False
     
@@ -67,38 +298,219 @@ class DockerManager:
             bool: True if successful, False otherwise
         """
         try:
-            client = self.get_docker_client(host)
-            
-            # Get all containers (running and stopped)
-            containers = client.containers.list(all=True)
+            summaries = self.list_containers(host)
             
             # Update host status
             host.status = 'online'
+            host.last_check = datetime.datetime.utcnow()
             
-            # Clear existing containers for this host
-            Container.query.filter_by(docker_host_id=host.id).delete()
-            
-            # Add containers to database
-            for container in containers:
-                status = container.status
-                container_db = Container(
-                    container_id=container.id,
-                    name=container.name,
-                    image=container.image.tags[0] if container.image.tags else container.image.id,
-                    status=status,
-                    docker_host_id=host.id
-                )
-                db.session.add(container_db)
-                
+            changes = self.sync_containers(host, summaries)
             db.session.commit()
+            
+            logger.info(
+                f"Synced {len(summaries)} containers from {host.url}: "
+                f"{changes['added']} added, {changes['updated']} updated, {changes['removed']} removed"
+            )
             return True
             
         except Exception as e:
             logger.error(f"Error refreshing containers from {host.url}: {str(e)}")
+            self.clients.invalidate(host.id)
             host.status = 'offline'
             db.session.commit()
             return False
     
+    def refresh_all_hosts(self, hosts, max_workers=8, timeout=15):
+        """
+        Refresh container inventory for many Docker hosts concurrently
+        
+        Listings are fetched in parallel with bounded concurrency; each host
+        that answers is then synced and committed in its own transaction on
+        the calling thread. Hosts that fail or take longer than the timeout
+        are marked offline without holding up the rest.
+        
+        Args:
+            hosts: Iterable of DockerHost objects
+            max_workers: Maximum number of daemons queried at once
+            timeout: Seconds allowed per host, counted from when its listing starts
+            
+        Returns:
+            list: Per-host summary dicts, in completion order:
+                  {'host_id', 'name', 'url', 'success', 'latency', 'added',
+                   'updated', 'removed', 'error'}
+        """
+        hosts = {host.id: host for host in hosts}
+        if not hosts:
+            return []
+        
+        summary = []
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(hosts)), thread_name_prefix='docker-refresh')
+        
+        def fetch(target, started):
+            started.append(time.monotonic())
+            return self.list_containers(target), time.monotonic() - started[0]
+        
+        try:
+            pending = {}
+            for host in hosts.values():
+                started = []
+                future = executor.submit(fetch, docker_host_target(host), started)
+                pending[future] = (host, started)
+            
+            while pending:
+                done, _ = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+                for future in done:
+                    host, _ = pending.pop(future)
+                    try:
+                        summaries, latency = future.result()
+                    except Exception as e:
+                        summary.append(self._mark_refresh_failed(host, str(e)))
+                        continue
+                    summary.append(self._apply_refresh(host, summaries, latency))
+                
+                now = time.monotonic()
+                for future, (host, started) in list(pending.items()):
+                    if started and now - started[0] > timeout:
+                        # Abandon the listing; the worker thread finishes on its own
+                        del pending[future]
+                        summary.append(self._mark_refresh_failed(host, f"Timed out after {timeout}s", latency=now - started[0]))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        return summary
+    
+    def _apply_refresh(self, host, summaries, latency):
+        """Sync one host's listing and commit it as a single transaction"""
+        try:
+            host.status = 'online'
+            host.last_check = datetime.datetime.utcnow()
+            changes = self.sync_containers(host, summaries)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error syncing containers for {host.url}: {str(e)}")
+            return self._refresh_result(host, False, latency, error=str(e))
+        return self._refresh_result(host, True, latency, **changes)
+    
+    def _mark_refresh_failed(self, host, error, latency=None):
+        logger.error(f"Error refreshing containers from {host.url}: {error}")
+        self.clients.invalidate(host.id)
+        host.status = 'offline'
+        host.last_check = datetime.datetime.utcnow()
+        db.session.commit()
+        return self._refresh_result(host, False, latency, error=error)
+    
+    @staticmethod
+    def _refresh_result(host, success, latency, added=0, updated=0, removed=0, error=None):
+        return {
+            'host_id': host.id,
+            'name': host.name,
+            'url': host.url,
+            'success': success,
+            'latency': round(latency, 3) if latency is not None else None,
+            'added': added,
+            'updated': updated,
+            'removed': removed,
+            'error': error
+        }
+    
+    def list_containers(self, host):
+        """
+        List all containers (running and stopped) on a Docker host
+        
+        Uses the summary data returned by a single list call; no per-container
+        or per-image inspect requests are made.
+        
+        Args:
+            host: DockerHost object
+            
+        Returns:
+            list: Container summary dicts as returned by the Docker API
+        """
+        client = self.get_docker_client(host)
+        return client.api.containers(all=True)
+    
+    @staticmethod
+    def summary_to_row(summary):
+        """
+        Map a Docker container summary to Container column values
+        
+        Args:
+            summary: Container summary dict from the Docker API
+            
+        Returns:
+            dict: container_id, name, image, status and labels
+        """
+        names = summary.get('Names') or []
+        labels = summary.get('Labels') or {}
+        return {
+            'container_id': summary['Id'],
+            'name': names[0].lstrip('/') if names else summary['Id'][:12],
+            'image': summary.get('Image') or summary.get('ImageID', ''),
+            'status': summary.get('State') or 'unknown',
+            'labels': json.dumps(labels, sort_keys=True) if labels else None
+        }
+    
+    def sync_containers(self, host, summaries):
+        """
+        Apply a container listing to the Container table incrementally
+        
+        Rows are matched on (docker_host_id, container_id), so existing
+        containers keep their primary key (and any experiments targeting
+        them). Only new, changed and vanished containers are written, each
+        kind as one bulk statement. The caller commits.
+        
+        Args:
+            host: DockerHost object
+            summaries: Container summary dicts from list_containers
+            
+        Returns:
+            dict: {'added': int, 'updated': int, 'removed': int}
+        """
+        existing = {
+            row.container_id: row
+            for row in db.session.execute(
+                select(Container.id, Container.container_id, Container.name,
+                       Container.image, Container.status, Container.labels)
+                .where(Container.docker_host_id == host.id)
+            )
+        }
+        
+        inserts = []
+        updates = []
+        seen = set()
+        for summary in summaries:
+            values = self.summary_to_row(summary)
+            seen.add(values['container_id'])
+            
+            row = existing.get(values['container_id'])
+            if row is None:
+                inserts.append(dict(values, docker_host_id=host.id))
+            elif (row.name, row.image, row.status, row.labels) != (
+                    values['name'], values['image'], values['status'], values['labels']):
+                updates.append({
+                    'id': row.id,
+                    'name': values['name'],
+                    'image': values['image'],
+                    'status': values['status'],
+                    'labels': values['labels']
+                })
+        
+        removed = [row.id for container_id, row in existing.items() if container_id not in seen]
+        
+        if inserts:
+            db.session.execute(insert(Container), inserts)
+        if updates:
+            db.session.execute(update(Container), updates)
+        for start in range(0, len(removed), self.DELETE_BATCH_SIZE):
+            batch = removed[start:start + self.DELETE_BATCH_SIZE]
+            db.session.execute(
+                delete(Container).where(Container.id.in_(batch)),
+                execution_options={'synchronize_session': False}
+            )
+        
+        return {'added': len(inserts), 'updated': len(updates), 'removed': len(removed)}
+    
     def stop_container(self, container):
         """
         Stop a container
@@ -118,7 +530,12 @@ class DockerManager:
             
         except docker.errors.NotFound:
             return {'success': False, 'message': f"Container {container.name} not found"}
+        except docker.errors.APIError as e:
+            logger.error(f"Error stopping container {container.name}: {str(e)}")
+            return {'success': False, 'message': str(e)}
         except Exception as e:
+            # Transport-level failure; don't hand the same client out again
+            self.clients.invalidate(container.docker_host_id)
             logger.error(f"Error stopping container {container.name}: {str(e)}")
             return {'success': False, 'message': str(e)}
     
@@ -141,7 +558,12 @@ class DockerManager:
             
         except docker.errors.NotFound:
             return {'success': False, 'message': f"Container {container.name} not found"}
+        except docker.errors.APIError as e:
+            logger.error(f"Error starting container {container.name}: {str(e)}")
+            return {'success': False, 'message': str(e)}
         except Exception as e:
+            # Transport-level failure; don't hand the same client out again
+            self.clients.invalidate(container.docker_host_id)
             logger.error(f"Error starting container {container.name}: {str(e)}")
             return {'success': False, 'message': str(e)}
     
@@ -164,6 +586,11 @@ class DockerManager:
             
         except docker.errors.NotFound:
             return {'success': False, 'message': f"Container {container.name} not found"}
+        except docker.errors.APIError as e:
+            logger.error(f"Error restarting container {container.name}: {str(e)}")
+            return {'success': False, 'message': str(e)}
         except Exception as e:
+            # Transport-level failure; don't hand the same client out again
+            self.clients.invalidate(container.docker_host_id)
             logger.error(f"Error restarting container {container.name}: {str(e)}")
             return {'success': False, 'message': str(e)}
@@ -0,0 +1,230 @@
+import datetime
+import logging
+import uuid
+from sqlalchemy import delete, func, select, update
+from app import db
+from models import ExperimentRun
+
+logger = logging.getLogger(__name__)
+
+class ExperimentRunQueue:
+    """
+    Database-backed queue of experiment runs for worker processes.
+    
+    When execution is queued, the scheduler leader enqueues a row each time
+    an experiment fires. Workers claim due rows under a time-limited lease,
+    extend the lease with heartbeats while the run is in flight, and mark it
+    done or failed. Rows whose lease expires (the worker died) go back to
+    the queue until max_attempts is reached, so a crashed worker does not
+    lose a run.
+    
+    Claims select rows with FOR UPDATE SKIP LOCKED, so concurrent workers on
+    PostgreSQL never block on or double-claim a row. SQLite has no row locks
+    and drops the clause; there the claiming UPDATE runs under SQLite's
+    single writer lock, which is just as exclusive.
+    
+    All methods must be called inside an app context.
+    """
+    
+    def __init__(self, lease_seconds=60, retry_delay=30):
+        self.lease_seconds = lease_seconds
+        self.retry_delay = retry_delay
+    
+    def enqueue(self, experiment_id, due_at=None, max_attempts=3):
+        """
+        Queue a run of an experiment
+        
+        Args:
+            experiment_id: ID of the Experiment to run
+            due_at: Earliest time (UTC) the run may start, defaults to now
+            max_attempts: Claims allowed before the run is marked failed
+            
+        Returns:
+            int: ID of the ExperimentRun
+        """
+        run = ExperimentRun(
+            experiment_id=experiment_id,
+            due_at=due_at or datetime.datetime.utcnow(),
+            max_attempts=max_attempts
+        )
+        db.session.add(run)
+        db.session.commit()
+        return run.id
+    
+    def claim(self, worker_id, limit=1):
+        """
+        Claim due runs for a worker
+        
+        Args:
+            worker_id: Identifier of the claiming worker
+            limit: Maximum number of runs to claim
+            
+        Returns:
+            list: ExperimentRun rows now leased to the worker; each has a
+                  unique lease_token used for heartbeat/complete/fail
+        """
+        if limit <= 0:
+            return []
+        now = datetime.datetime.utcnow()
+        
+        due = (
+            select(ExperimentRun.id)
+            .where(ExperimentRun.status == 'queued', ExperimentRun.due_at <= now)
+            .order_by(ExperimentRun.due_at, ExperimentRun.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        ids = db.session.execute(due).scalars().all()
+        if not ids:
+            db.session.rollback()
+            return []
+        
+        # One token per run, so a lost lease can't be completed by its old holder
+        tokens = {run_id: uuid.uuid4().hex for run_id in ids}
+        for run_id, token in tokens.items():
+            db.session.execute(
+                update(ExperimentRun)
+                .where(ExperimentRun.id == run_id, ExperimentRun.status == 'queued')
+                .values(
+                    status='running',
+                    worker_id=worker_id,
+                    lease_token=token,
+                    lease_expires_at=now + datetime.timedelta(seconds=self.lease_seconds),
+                    attempts=ExperimentRun.attempts + 1
+                )
+                .execution_options(synchronize_session=False)
+            )
+        db.session.commit()
+        
+        return ExperimentRun.query.filter(
+            ExperimentRun.lease_token.in_(list(tokens.values())),
+            ExperimentRun.worker_id == worker_id
+        ).order_by(ExperimentRun.due_at, ExperimentRun.id).all()
+    
+    def heartbeat(self, lease_tokens):
+        """
+        Extend the leases of in-flight runs
+        
+        Args:
+            lease_tokens: Lease tokens held by the worker
+            
+        Returns:
+            int: Number of leases still held and extended
+        """
+        if not lease_tokens:
+            return 0
+        renewed = db.session.execute(
+            update(ExperimentRun)
+            .where(ExperimentRun.lease_token.in_(list(lease_tokens)), ExperimentRun.status == 'running')
+            .values(lease_expires_at=datetime.datetime.utcnow() + datetime.timedelta(seconds=self.lease_seconds))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        return renewed
+    
+    def complete(self, lease_token, log_id=None, error=None):
+        """
+        Mark a leased run as done
+        
+        Args:
+            lease_token: Lease token of the run
+            log_id: ID of the ExperimentLog the run wrote
+            error: Error to record on a run that must not be retried
+            
+        Returns:
+            bool: False if the lease had already been lost
+        """
+        completed = db.session.execute(
+            update(ExperimentRun)
+            .where(ExperimentRun.lease_token == lease_token, ExperimentRun.status == 'running')
+            .values(status='done', log_id=log_id, error=error, lease_expires_at=None, finished_at=datetime.datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        return completed == 1
+    
+    def fail(self, lease_token, error):
+        """
+        Give up a leased run after an error, retrying it if attempts remain
+        
+        Args:
+            lease_token: Lease token of the run
+            error: Error message
+            
+        Returns:
+            str: New status ('queued' or 'failed'), or None if the lease was lost
+        """
+        return self._release(ExperimentRun.lease_token == lease_token, error)[0]
+    
+    def requeue_expired(self):
+        """
+        Return runs whose worker stopped heartbeating to the queue
+        
+        Returns:
+            int: Number of runs requeued or, with no attempts left, failed
+        """
+        now = datetime.datetime.utcnow()
+        _, count = self._release(ExperimentRun.lease_expires_at < now, 'Lease expired before the run finished')
+        if count:
+            logger.warning(f"Released {count} experiment runs with expired leases")
+        return count
+    
+    def _release(self, condition, error):
+        now = datetime.datetime.utcnow()
+        running = (ExperimentRun.status == 'running', condition)
+        
+        retried = db.session.execute(
+            update(ExperimentRun)
+            .where(*running, ExperimentRun.attempts < ExperimentRun.max_attempts)
+            .values(
+                status='queued',
+                due_at=now + datetime.timedelta(seconds=self.retry_delay),
+                worker_id=None,
+                lease_token=None,
+                lease_expires_at=None,
+                error=error
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        failed = db.session.execute(
+            update(ExperimentRun)
+            .where(*running)
+            .values(status='failed', lease_expires_at=None, error=error, finished_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        
+        status = 'queued' if retried else 'failed' if failed else None
+        return status, retried + failed
+    
+    def purge(self, older_than_days=7):
+        """
+        Delete finished runs
+        
+        Args:
+            older_than_days: Keep runs that finished more recently than this
+            
+        Returns:
+            int: Number of rows deleted
+        """
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=older_than_days)
+        deleted = db.session.execute(
+            delete(ExperimentRun)
+            .where(ExperimentRun.status.in_(['done', 'failed']), ExperimentRun.finished_at < cutoff)
+        ).rowcount
+        db.session.commit()
+        return deleted
+    
+    def stats(self):
+        """
+        Returns:
+            dict: Number of runs per status
+        """
+        counts = db.session.execute(
+            select(ExperimentRun.status, func.count()).group_by(ExperimentRun.status)
+        ).all()
+        return {status: count for status, count in counts}
+
+
+# Process-wide queue shared by the scheduler, workers and routes
+run_queue = ExperimentRunQueue()
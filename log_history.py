@@ -0,0 +1,259 @@
+import datetime
+import logging
+import threading
+import time
+from collections import Counter
+from sqlalchemy import case, func, select, tuple_
+from app import db
+from log_rollups import day_bucket, hour_bucket, on_rollups_changed
+from models import ExperimentLog, ExperimentLogDaily, ExperimentLogHourly
+
+logger = logging.getLogger(__name__)
+
+# Longest range the history chart may request, in days
+MAX_HISTORY_DAYS = 365
+
+# Bucket size for a range: (up to this many days, bucket); the last entry catches the rest
+HISTORY_BUCKETS = (
+    (2, 'hour'),
+    (90, 'day'),
+    (None, 'week'),
+)
+
+def week_bucket(moment):
+    # Weeks start on Monday
+    return day_bucket(moment) - datetime.timedelta(days=moment.weekday())
+
+# Truncation, step and label format per bucket size
+BUCKET_FORMATS = {
+    'hour': (hour_bucket, datetime.timedelta(hours=1), '%Y-%m-%d %H:00'),
+    'day': (day_bucket, datetime.timedelta(days=1), '%Y-%m-%d'),
+    'week': (week_bucket, datetime.timedelta(weeks=1), '%Y-%m-%d'),
+}
+
+def bucket_for_range(days):
+    for max_days, bucket in HISTORY_BUCKETS:
+        if max_days is None or days <= max_days:
+            return bucket
+
+
+def experiment_history(days, now=None):
+    """
+    Count successful and failed experiment runs per bucket over the last days
+    
+    Reads the hourly or daily rollups with a single GROUP BY, so the cost
+    depends on the number of buckets rather than the number of logs. Weeks
+    are folded from the daily rollup.
+    
+    Args:
+        days: Length of the range, clamped to 1..MAX_HISTORY_DAYS
+        now: End of the range, defaults to the current UTC time
+        
+    Returns:
+        dict: {'bucket', 'labels', 'success', 'failure'}
+    """
+    days = max(1, min(days, MAX_HISTORY_DAYS))
+    now = now or datetime.datetime.utcnow()
+    bucket = bucket_for_range(days)
+    truncate, step, label_format = BUCKET_FORMATS[bucket]
+    start = truncate(now - datetime.timedelta(days=days))
+    
+    model = ExperimentLogHourly if bucket == 'hour' else ExperimentLogDaily
+    rows = db.session.execute(
+        select(model.bucket, model.status, func.sum(model.count))
+        .where(model.bucket >= start, model.status.in_(('success', 'failure')))
+        .group_by(model.bucket, model.status)
+    ).all()
+    
+    counts = Counter()
+    for row_bucket, status, count in rows:
+        counts[(truncate(row_bucket), status)] += count
+    
+    labels, success, failure = [], [], []
+    current = start
+    while current <= now:
+        labels.append(current.strftime(label_format))
+        success.append(counts[(current, 'success')])
+        failure.append(counts[(current, 'failure')])
+        current += step
+    
+    return {'bucket': bucket, 'labels': labels, 'success': success, 'failure': failure}
+
+
+# Filters accepted by the reports page, all columns shared by logs and rollups
+LOG_FILTERS = ('status', 'action', 'target_type', 'target_id')
+
+def apply_log_filters(statement, model, filters):
+    """
+    Restrict a query on ExperimentLog or a rollup model to the given filters
+    
+    Args:
+        statement: Select statement to restrict
+        model: ExperimentLog, ExperimentLogHourly or ExperimentLogDaily
+        filters: Dict of LOG_FILTERS names to values; missing or None means any
+        
+    Returns:
+        The restricted statement
+    """
+    for name in LOG_FILTERS:
+        if filters.get(name) is not None:
+            statement = statement.where(getattr(model, name) == filters[name])
+    return statement
+
+
+def log_summary(filters=None):
+    """
+    Summarize experiment logs with one aggregate query over the daily rollup
+    
+    The daily rollup is kept indefinitely, so archived logs are included.
+    
+    Args:
+        filters: Optional dict of LOG_FILTERS names to values
+        
+    Returns:
+        dict: {'total', 'success', 'success_rate', 'server', 'container', 'stop', 'start', 'restart'}
+    """
+    model = ExperimentLogDaily
+    
+    def count_where(condition):
+        return func.coalesce(func.sum(case((condition, model.count), else_=0)), 0)
+    
+    statement = apply_log_filters(select(
+        func.coalesce(func.sum(model.count), 0),
+        count_where(model.status == 'success'),
+        count_where(model.target_type == 'server'),
+        count_where(model.target_type == 'container'),
+        count_where(model.action == 'stop'),
+        count_where(model.action == 'start'),
+        count_where(model.action == 'restart'),
+    ), model, filters or {})
+    
+    row = db.session.execute(statement).one()
+    summary = dict(zip(('total', 'success', 'server', 'container', 'stop', 'start', 'restart'), (int(value) for value in row)))
+    summary['success_rate'] = (summary['success'] / summary['total'] * 100) if summary['total'] > 0 else 0
+    return summary
+
+
+def encode_cursor(log):
+    return f"{log.execution_time.isoformat()}_{log.id}"
+
+
+def decode_cursor(cursor):
+    """
+    Parse a cursor produced by encode_cursor
+    
+    Returns:
+        tuple: (execution_time, id), or None if the cursor is malformed
+    """
+    try:
+        moment, log_id = cursor.rsplit('_', 1)
+        return datetime.datetime.fromisoformat(moment), int(log_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def log_page(filters=None, before=None, after=None, per_page=50):
+    """
+    Fetch one page of logs, newest first, by keyset on (execution_time, id)
+    
+    Each page is a bounded index range scan, so its cost does not depend on
+    how far back the page is. Pass the next_cursor of a page as before to
+    move to older logs, or its prev_cursor as after to move to newer ones.
+    
+    Args:
+        filters: Optional dict of LOG_FILTERS names to values
+        before: Cursor; return logs older than it
+        after: Cursor; return logs newer than it (ignored if before is set)
+        per_page: Page size
+        
+    Returns:
+        dict: {'logs', 'next_cursor', 'prev_cursor'}; a cursor is None when
+        there is no page in that direction
+    """
+    key = tuple_(ExperimentLog.execution_time, ExperimentLog.id)
+    statement = apply_log_filters(select(ExperimentLog), ExperimentLog, filters or {})
+    before, after = decode_cursor(before), decode_cursor(after)
+    
+    # Fetch one extra row to learn whether another page follows
+    if after and not before:
+        statement = statement.where(key > after).order_by(ExperimentLog.execution_time, ExperimentLog.id)
+        logs = db.session.scalars(statement.limit(per_page + 1)).all()
+        has_newer, has_older = len(logs) > per_page, True
+        logs = list(reversed(logs[:per_page]))
+    else:
+        if before:
+            statement = statement.where(key < before)
+        statement = statement.order_by(ExperimentLog.execution_time.desc(), ExperimentLog.id.desc())
+        logs = db.session.scalars(statement.limit(per_page + 1)).all()
+        has_newer, has_older = before is not None, len(logs) > per_page
+        logs = logs[:per_page]
+    
+    return {
+        'logs': logs,
+        'next_cursor': encode_cursor(logs[-1]) if logs and has_older else None,
+        'prev_cursor': encode_cursor(logs[0]) if logs and has_newer else None,
+    }
+
+
+class HistoryCache:
+    """
+    Short-lived cache for history chart and report summary results.
+    
+    Entries expire after ttl seconds and the whole cache is dropped whenever
+    this process commits new logs. Logs written by other processes (such as
+    queue workers) show up once the entry expires.
+    """
+    
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._entries = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+    
+    def get(self, key, compute):
+        """
+        Return the cached value for key, computing and storing it if needed
+        
+        Args:
+            key: Cache key
+            compute: Callable producing the value
+            
+        Returns:
+            The cached or freshly computed value
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._hits += 1
+                return entry[1]
+            self._misses += 1
+            generation = self._generation
+        
+        value = compute()
+        
+        with self._lock:
+            # Skip storing if logs arrived while the value was being computed
+            if generation == self._generation:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+        return value
+    
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self._hits,
+                'misses': self._misses,
+                'ttl': self.ttl,
+            }
+
+
+# Process-wide cache, dropped whenever a transaction that changed the rollups commits
+history_cache = HistoryCache()
+on_rollups_changed(history_cache.invalidate)
@@ -0,0 +1,164 @@
+import datetime
+import gzip
+import json
+import logging
+import os
+from sqlalchemy import delete
+from app import app, db
+from log_rollups import rebuild_rollups
+from models import ExperimentLog, ExperimentLogHourly, MaintenanceMarker
+
+logger = logging.getLogger(__name__)
+
+# MaintenanceMarker recorded once the rollups have been rebuilt from the raw logs
+ROLLUP_BACKFILL_MARKER = 'rollups_backfilled'
+
+class LogRetention:
+    """
+    Retention policy for ExperimentLog rows.
+    
+    Raw logs older than retention_days are moved, oldest first, into gzip
+    NDJSON archive segments (one file per batch, named by date and ID range)
+    and then deleted. Each segment is fully written and renamed into place
+    before its rows are deleted, so an interrupted run never loses logs.
+    
+    The daily rollups are kept indefinitely, so history charts still cover
+    archived periods; hourly rollups are pruned after hourly_retention_days.
+    
+    All methods must be called inside an app context.
+    """
+    
+    def __init__(self, retention_days=90, archive_dir=None, batch_size=10000, hourly_retention_days=90):
+        self.retention_days = retention_days
+        self.archive_dir = archive_dir
+        self.batch_size = batch_size
+        self.hourly_retention_days = hourly_retention_days
+    
+    def run(self):
+        """
+        Apply the whole policy
+        
+        Returns:
+            dict: {'backfilled', 'archived', 'segments', 'hourly_pruned'}
+        """
+        summary = {'backfilled': self.backfill_rollups(), 'archived': 0, 'segments': [], 'hourly_pruned': 0}
+        
+        now = datetime.datetime.utcnow()
+        if self.retention_days:
+            summary['archived'], summary['segments'] = self.archive(now - datetime.timedelta(days=self.retention_days))
+        if self.hourly_retention_days:
+            summary['hourly_pruned'] = self.prune_hourly(now - datetime.timedelta(days=self.hourly_retention_days))
+        
+        logger.info(
+            f"Log retention: {summary['archived']} logs archived in {len(summary['segments'])} segments, "
+            f"{summary['hourly_pruned']} hourly rollups pruned"
+        )
+        return summary
+    
+    def backfill_rollups(self):
+        """
+        Rebuild the rollups from raw logs once, the first time this runs
+        
+        Logs written before the rollups existed are only counted by a rebuild.
+        Logs written since are rolled up as they arrive, so the rollups are not
+        empty by the time this runs. Completion is therefore recorded with a
+        MaintenanceMarker rather than inferred from the rollup contents.
+        
+        Returns:
+            int: Number of logs counted, 0 if the backfill was already done
+        """
+        if db.session.get(MaintenanceMarker, ROLLUP_BACKFILL_MARKER) is not None:
+            return 0
+        
+        counted = rebuild_rollups()
+        db.session.add(MaintenanceMarker(name=ROLLUP_BACKFILL_MARKER))
+        db.session.commit()
+        logger.info(f"Backfilled log rollups from {counted} logs")
+        return counted
+    
+    def archive(self, before):
+        """
+        Archive and delete logs executed before a cutoff
+        
+        Args:
+            before: Cutoff time (UTC)
+            
+        Returns:
+            tuple: (number of logs archived, list of segment paths)
+        """
+        os.makedirs(self.archive_dir, exist_ok=True)
+        archived, segments = 0, []
+        
+        while True:
+            logs = (
+                ExperimentLog.query
+                .filter(ExperimentLog.execution_time < before)
+                .order_by(ExperimentLog.id)
+                .limit(self.batch_size)
+                .all()
+            )
+            if not logs:
+                break
+            
+            segments.append(self._write_segment(logs))
+            ids = [log.id for log in logs]
+            # A plain delete: archived logs stay counted in the rollups
+            db.session.execute(
+                delete(ExperimentLog).where(ExperimentLog.id.in_(ids)),
+                execution_options={'synchronize_session': False}
+            )
+            db.session.commit()
+            db.session.expunge_all()
+            archived += len(ids)
+        
+        return archived, segments
+    
+    def _write_segment(self, logs):
+        first, last = logs[0], logs[-1]
+        times = [log.execution_time for log in logs]
+        name = (
+            f"experiment_logs_{min(times):%Y%m%d}-{max(times):%Y%m%d}"
+            f"_{first.id}-{last.id}.ndjson.gz"
+        )
+        path = os.path.join(self.archive_dir, name)
+        
+        # Write under a temporary name so a partial file is never mistaken for a segment
+        partial = path + '.partial'
+        with gzip.open(partial, 'wt', encoding='utf-8') as segment:
+            for log in logs:
+                segment.write(json.dumps(log.to_dict()))
+                segment.write('\n')
+        os.replace(partial, path)
+        return path
+    
+    def prune_hourly(self, before):
+        """
+        Delete hourly rollups older than a cutoff
+        
+        Args:
+            before: Cutoff time (UTC)
+            
+        Returns:
+            int: Number of rollup rows deleted
+        """
+        pruned = db.session.execute(
+            delete(ExperimentLogHourly).where(ExperimentLogHourly.bucket < before)
+        ).rowcount
+        db.session.commit()
+        return pruned
+
+
+def run_log_retention():
+    """Scheduler job entry point: apply the log retention policy"""
+    retention = LogRetention(
+        retention_days=app.config.get('LOG_RETENTION_DAYS', 90),
+        archive_dir=app.config.get('LOG_ARCHIVE_DIR') or os.path.join(app.instance_path, 'log_archive')
+    )
+    with app.app_context():
+        try:
+            retention.run()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Log retention failed: {str(e)}")
+        finally:
+            db.session.remove()
@@ -0,0 +1,229 @@
+import datetime
+import logging
+from collections import Counter
+from sqlalchemy import bindparam, delete, event, func, insert, select, update
+from sqlalchemy.orm import Session
+from app import db
+from models import ExperimentLog, ExperimentLogDaily, ExperimentLogHourly
+
+logger = logging.getLogger(__name__)
+
+# Columns identifying a rollup row, besides the bucket
+KEY_COLUMNS = ('target_type', 'target_id', 'action', 'status')
+
+def hour_bucket(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+def day_bucket(moment):
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+# Rollup model and the function truncating a timestamp to its bucket
+ROLLUPS = (
+    (ExperimentLogHourly, hour_bucket),
+    (ExperimentLogDaily, day_bucket),
+)
+
+# Callbacks run whenever logs are added to the rollups
+_change_listeners = []
+
+def on_rollups_changed(callback):
+    """Register a callback run (without arguments) after a transaction that changed the rollups commits"""
+    _change_listeners.append(callback)
+
+
+def record_rollups(session, rows):
+    """
+    Add newly written ExperimentLog rows to the hourly and daily rollups
+    
+    Runs in the same transaction as the log insert, so rollups and raw logs
+    commit (or roll back) together.
+    
+    Args:
+        session: Session whose transaction inserted the rows
+        rows: Dicts with execution_time, target_type, target_id, action, status
+    """
+    connection = session.connection()
+    for model, truncate in ROLLUPS:
+        counts = Counter(
+            (truncate(row['execution_time']),) + tuple(row[column] for column in KEY_COLUMNS)
+            for row in rows
+        )
+        _increment(connection, model, counts)
+    
+    if rows:
+        _mark_changed(session)
+
+
+def remove_rollups(session, rows):
+    """
+    Subtract deleted ExperimentLog rows from the hourly and daily rollups
+    
+    Rollup rows that drop to zero are removed. Runs in the same transaction
+    as the log delete. Archiving does not call this: the rollups are meant
+    to keep counting archived logs.
+    
+    Args:
+        session: Session whose transaction deleted the rows
+        rows: Dicts with execution_time, target_type, target_id, action, status
+    """
+    connection = session.connection()
+    for model, truncate in ROLLUPS:
+        counts = Counter(
+            (truncate(row['execution_time']),) + tuple(row[column] for column in KEY_COLUMNS)
+            for row in rows
+        )
+        _decrement(connection, model, counts)
+    
+    if rows:
+        _mark_changed(session)
+
+
+def _decrement(connection, model, counts):
+    if not counts:
+        return
+    key_columns = ('bucket',) + KEY_COLUMNS
+    connection.execute(
+        update(model)
+        .where(*(getattr(model, column) == bindparam(f'key_{column}') for column in key_columns))
+        .values(count=model.count - bindparam('amount')),
+        [
+            dict({f'key_{column}': value for column, value in zip(key_columns, key)}, amount=count)
+            for key, count in counts.items()
+        ]
+    )
+    connection.execute(
+        delete(model).where(model.bucket.in_({key[0] for key in counts}), model.count <= 0)
+    )
+
+
+def _increment(connection, model, counts):
+    if not counts:
+        return
+    rows = [
+        dict(zip(('bucket',) + KEY_COLUMNS, key), count=count)
+        for key, count in counts.items()
+    ]
+    
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        statement = upsert(model)
+        statement = statement.on_conflict_do_update(
+            index_elements=['bucket', *KEY_COLUMNS],
+            set_={'count': model.count + statement.excluded.count}
+        )
+        connection.execute(statement, rows)
+        return
+    
+    # Databases without an upsert: update, then insert the rows that were missing
+    for row in rows:
+        updated = connection.execute(
+            update(model)
+            .where(*(getattr(model, column) == row[column] for column in ('bucket',) + KEY_COLUMNS))
+            .values(count=model.count + row['count'])
+        ).rowcount
+        if not updated:
+            connection.execute(insert(model), [row])
+
+
+def rebuild_rollups(session=None):
+    """
+    Recompute both rollups from the raw ExperimentLog rows
+    
+    Used to backfill the rollups for logs written before they existed.
+    Replaces the rollup contents in a single transaction; the caller commits.
+    Logs that have already been archived are not included.
+    
+    Args:
+        session: Session to use, defaults to db.session
+        
+    Returns:
+        int: Number of log rows counted
+    """
+    session = session or db.session
+    
+    # Aggregate before deleting: the deletes take the SQLite write gate, which
+    # should not be held across a full-table GROUP BY. Logs inserted in between
+    # (above last_id) are counted in a second, small pass once the gate is held
+    last_id = session.execute(select(func.max(ExperimentLog.id))).scalar() or 0
+    hourly, daily = Counter(), Counter()
+    counted = _aggregate(session, hourly, daily, ExperimentLog.id <= last_id)
+    
+    for model, _ in ROLLUPS:
+        session.query(model).delete(synchronize_session=False)
+    counted += _aggregate(session, hourly, daily, ExperimentLog.id > last_id)
+    
+    connection = session.connection()
+    _increment(connection, ExperimentLogHourly, hourly)
+    _increment(connection, ExperimentLogDaily, daily)
+    _mark_changed(session)
+    return counted
+
+
+def _aggregate(session, hourly, daily, condition):
+    """Add per-hour and per-day log counts matching condition to the counters"""
+    # Aggregate per hour in SQL, then fold the hours into days
+    hour = _hour_expression(session)
+    grouped = session.execute(
+        select(hour.label('bucket'), *(getattr(ExperimentLog, column) for column in KEY_COLUMNS), func.count())
+        .where(condition)
+        .group_by(hour, *(getattr(ExperimentLog, column) for column in KEY_COLUMNS))
+    ).all()
+    
+    counted = 0
+    for bucket, *key, count in grouped:
+        if isinstance(bucket, str):
+            bucket = datetime.datetime.fromisoformat(bucket)
+        hourly[(bucket, *key)] += count
+        daily[(day_bucket(bucket), *key)] += count
+        counted += count
+    return counted
+
+
+def _mark_changed(session):
+    # Listeners run once the transaction commits (see _rollups_committed)
+    session.info['rollups_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _rollups_committed(session):
+    # after_commit fires once the database has committed, so other connections
+    # already see the new rows. Releasing a savepoint is not the real commit
+    if session.get_nested_transaction() is not None:
+        return
+    if session.info.pop('rollups_changed', False):
+        for callback in _change_listeners:
+            callback()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _rollups_rolled_back(session):
+    # A rolled-back savepoint keeps the flag: the outer transaction may still commit
+    if session.get_nested_transaction() is None:
+        session.info.pop('rollups_changed', None)
+
+
+def _hour_expression(session):
+    """SQL expression truncating ExperimentLog.execution_time to the hour"""
+    if session.get_bind().dialect.name == 'sqlite':
+        return func.strftime('%Y-%m-%d %H:00:00', ExperimentLog.execution_time)
+    return func.date_trunc('hour', ExperimentLog.execution_time)
+
+
+@event.listens_for(Session, 'after_flush')
+def _rollup_flushed_logs(session, flush_context):
+    # Logs added or deleted through the ORM (bulk paths update the rollups themselves)
+    def key_rows(objects):
+        return [
+            {column: getattr(obj, column) for column in ('execution_time',) + KEY_COLUMNS}
+            for obj in objects if isinstance(obj, ExperimentLog)
+        ]
+    
+    added, deleted = key_rows(session.new), key_rows(session.deleted)
+    if added:
+        record_rollups(session, added)
+    if deleted:
+        remove_rollups(session, deleted)
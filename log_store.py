@@ -0,0 +1,314 @@
+import atexit
+import datetime
+import io
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from sqlalchemy import and_, delete, insert, update
+from app import app, db
+from log_rollups import KEY_COLUMNS, record_rollups, remove_rollups
+from models import Container, ExperimentLog, Server
+
+logger = logging.getLogger(__name__)
+
+# Columns written by bulk inserts, in COPY order
+LOG_COLUMNS = [column.name for column in ExperimentLog.__table__.columns if column.name != 'id']
+
+# Batches at least this large use COPY on PostgreSQL
+COPY_THRESHOLD = 500
+
+def insert_logs(rows, session=None, return_ids=False):
+    """
+    Insert many ExperimentLog rows in the current transaction
+    
+    On PostgreSQL (psycopg2), large batches are streamed with COPY and
+    smaller ones sent as multi-row INSERT ... VALUES statements. Other
+    databases use a single executemany. The hourly and daily rollups are
+    updated in the same transaction. The caller commits.
+    
+    Args:
+        rows: List of dicts keyed by ExperimentLog column name; a missing
+              execution_time defaults to now
+        session: Session to use, defaults to db.session
+        return_ids: Return the new IDs (in row order) instead of a count;
+                    uses INSERT ... RETURNING rather than COPY
+        
+    Returns:
+        int or list: Number of rows inserted, or their IDs
+    """
+    if not rows:
+        return [] if return_ids else 0
+    session = session or db.session
+    now = datetime.datetime.utcnow()
+    rows = [dict(row, execution_time=row.get('execution_time') or now) for row in rows]
+    
+    connection = session.connection()
+    if return_ids:
+        statement = insert(ExperimentLog).returning(ExperimentLog.id, sort_by_parameter_order=True)
+        ids = session.execute(statement, rows).scalars().all()
+    elif connection.dialect.name == 'postgresql' and connection.dialect.driver == 'psycopg2' \
+            and len(rows) >= COPY_THRESHOLD:
+        _copy_logs(connection, rows)
+    else:
+        # psycopg2 turns this executemany into multi-row VALUES pages
+        session.execute(insert(ExperimentLog), rows)
+    
+    # After the ORM insert, which takes the SQLite write gate
+    record_rollups(session, rows)
+    return ids if return_ids else len(rows)
+
+
+def delete_logs(*conditions, session=None):
+    """
+    Delete ExperimentLog rows and subtract them from the rollups
+    
+    Use this rather than a bulk delete, which would leave the rollups still
+    counting the removed logs. The caller commits.
+    
+    Args:
+        conditions: SQL conditions selecting the logs to delete
+        session: Session to use, defaults to db.session
+        
+    Returns:
+        int: Number of logs deleted
+    """
+    session = session or db.session
+    # RETURNING reports exactly the rows this statement removed
+    deleted = session.execute(
+        delete(ExperimentLog)
+        .where(and_(*conditions))
+        .returning(ExperimentLog.execution_time, *(getattr(ExperimentLog, column) for column in KEY_COLUMNS)),
+        execution_options={'synchronize_session': False}
+    ).mappings().all()
+    
+    # After the ORM delete, which takes the SQLite write gate
+    remove_rollups(session, deleted)
+    return len(deleted)
+
+
+def _copy_logs(connection, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(','.join(_csv_value(row.get(column)) for column in LOG_COLUMNS))
+        buffer.write('\n')
+    buffer.seek(0)
+    
+    cursor = connection.connection.driver_connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {ExperimentLog.__tablename__} ({', '.join(LOG_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+    finally:
+        cursor.close()
+
+
+def _csv_value(value):
+    # In CSV COPY an unquoted empty field is NULL and a quoted one is ''
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat(sep=' ')
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+class ExperimentLogSink:
+    """
+    Buffers ExperimentLog writes and commits them in batches.
+    
+    submit() queues a row and returns at once; a writer thread collects rows
+    until it has batch_size of them or flush_interval has passed since the
+    first, then inserts the whole batch (plus any target status changes
+    that came with it) in one transaction. The queue is bounded: when the
+    database falls behind, submit() blocks the producer instead of letting
+    memory grow. Pending rows are flushed on stop() and at interpreter exit.
+    
+    A batch that fails to commit is retried, then written one row at a time,
+    so a bad row or a transient error only loses the rows that keep failing.
+    
+    Rows that must be visible immediately (e.g. to hand their ID to the
+    recovery watcher) can wait on the returned future, or be written
+    directly instead.
+    """
+    
+    STATUS_MODELS = {'server': Server, 'container': Container}
+    
+    def __init__(self, batch_size=500, flush_interval=0.5, max_queue=10000, put_timeout=30,
+                 retries=2, retry_delay=0.5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.flushed = 0
+        self.batches = 0
+        
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+    
+    def submit(self, row, target_status=None):
+        """
+        Queue an ExperimentLog row
+        
+        Args:
+            row: Dict keyed by ExperimentLog column name
+            target_status: Optional (target_type, target_id, status) to apply
+                           in the same transaction as the log
+            
+        Returns:
+            concurrent.futures.Future: Resolves to the log's ID once committed
+        """
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put((row, target_status, future), timeout=self.put_timeout)
+        except queue.Full:
+            raise RuntimeError(f"Experiment log queue stayed full for {self.put_timeout}s")
+        return future
+    
+    def flush(self, timeout=None):
+        """
+        Wait until every row queued so far has been written
+        
+        Args:
+            timeout: Seconds to wait
+        """
+        if self._thread is not None:
+            self.submit(None).result(timeout)
+    
+    def stop(self):
+        """Flush pending rows and stop the writer thread"""
+        with self._lock:
+            thread, self._stopping = self._thread, True
+        if thread is None:
+            return
+        self._queue.put(None)
+        thread.join()
+        with self._lock:
+            self._thread, self._stopping = None, False
+        logger.info(f"Experiment log sink stopped after {self.flushed} rows in {self.batches} batches")
+    
+    def stats(self):
+        """
+        Returns:
+            dict: Rows written, batches committed and rows still queued
+        """
+        return {'flushed': self.flushed, 'batches': self.batches, 'queued': self._queue.qsize()}
+    
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            if self._stopping:
+                raise RuntimeError("Experiment log sink is stopping")
+            self._thread = threading.Thread(target=self._run, name='experiment-log-sink', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+    
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            
+            # Keep collecting until the batch is full or the interval is up
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            self._write(batch)
+        
+        # Drain whatever was queued behind the stop marker
+        remaining = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                remaining.append(item)
+        for start in range(0, len(remaining), self.batch_size):
+            self._write(remaining[start:start + self.batch_size])
+    
+    def _write(self, batch):
+        # flush() markers carry no row; they resolve once earlier rows are in
+        entries = [(row, target_status, future) for row, target_status, future in batch if row is not None]
+        
+        if entries and self._commit(entries, attempts=self.retries + 1) is not None:
+            # Write the rows one at a time, so only the rows that fail are lost
+            logger.warning(f"Writing {len(entries)} experiment logs one at a time after the batch failed")
+            for entry in entries:
+                error = self._commit([entry], attempts=1)
+                if error is not None:
+                    row, _, future = entry
+                    logger.error(f"Dropped experiment log for {row.get('target_type')} {row.get('target_id')}: {str(error)}")
+                    future.set_exception(error)
+        
+        for row, _, future in batch:
+            if row is None:
+                future.set_result(None)
+    
+    def _commit(self, entries, attempts):
+        """Write entries in one transaction, resolving their futures; returns the last error on failure"""
+        error = None
+        for attempt in range(attempts):
+            if attempt:
+                time.sleep(self.retry_delay * attempt)
+            with app.app_context():
+                try:
+                    ids = insert_logs([row for row, _, _ in entries], return_ids=True)
+                    self._apply_statuses([target_status for _, target_status, _ in entries if target_status])
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.warning(f"Failed to write {len(entries)} experiment logs (attempt {attempt + 1}): {str(e)}")
+                    error = e
+                    continue
+                finally:
+                    db.session.remove()
+            
+            self.flushed += len(entries)
+            self.batches += 1
+            for (_, _, future), log_id in zip(entries, ids):
+                future.set_result(log_id)
+            return None
+        return error
+    
+    def _apply_statuses(self, changes):
+        # The latest change per target wins; then one UPDATE per status value
+        latest = {}
+        for target_type, target_id, status in changes:
+            latest[(target_type, target_id)] = status
+        
+        grouped = {}
+        for (target_type, target_id), status in latest.items():
+            grouped.setdefault((target_type, status), []).append(target_id)
+        
+        for (target_type, status), target_ids in grouped.items():
+            model = self.STATUS_MODELS[target_type]
+            db.session.execute(
+                update(model).where(model.id.in_(target_ids)).values(status=status),
+                execution_options={'synchronize_session': False}
+            )
+
+
+# Process-wide sink for ExperimentLog rows
+log_sink = ExperimentLogSink()
@@ -0,0 +1,111 @@
+import logging
+from sqlalchemy import and_, delete, func, inspect, select, text
+from sqlalchemy.exc import DBAPIError
+
+logger = logging.getLogger(__name__)
+
+# Advisory lock key serializing schema upgrades on PostgreSQL (arbitrary, fixed)
+SCHEMA_LOCK_KEY = 7345912001
+
+def upgrade_schema(db):
+    """
+    Bring an existing database up to date with the models
+    
+    db.create_all() only creates missing tables, so columns added to a model
+    after its table was created are added here with ALTER TABLE, followed by
+    any indexes the table is missing. Only nullable columns without server
+    defaults are added automatically. Rows that would violate a new unique
+    index are removed first, keeping the oldest (lowest ID) of each group.
+    
+    Every worker process runs this at import, so several may race. On
+    PostgreSQL the upgrade holds an advisory lock and inspects the schema
+    only once it has the lock. Elsewhere a column or index that another
+    process created in the meantime is detected and skipped.
+    
+    Args:
+        db: Flask-SQLAlchemy instance (inside an app context)
+        
+    Returns:
+        list: Names of the columns that were added, as 'table.column'
+    """
+    engine = db.engine
+    added = []
+    
+    with engine.begin() as connection:
+        _lock_schema(connection)
+        inspector = inspect(connection)
+        existing_tables = set(inspector.get_table_names())
+        
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                if not column.nullable or column.server_default is not None:
+                    logger.warning(f"Cannot add column {table.name}.{column.name} automatically")
+                    continue
+                
+                column_type = column.type.compile(dialect=engine.dialect)
+                try:
+                    connection.execute(text(
+                        f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                    ))
+                except DBAPIError:
+                    if not _has_column(connection, table.name, column.name):
+                        raise
+                    logger.info(f"Column {table.name}.{column.name} was added by another process")
+                    continue
+                added.append(f"{table.name}.{column.name}")
+            
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing_indexes:
+                    continue
+                if index.unique:
+                    _remove_duplicates(connection, table, list(index.columns))
+                try:
+                    index.create(connection, checkfirst=True)
+                except DBAPIError:
+                    if not _has_index(connection, table.name, index.name):
+                        raise
+                    logger.info(f"Index {index.name} was created by another process")
+                    continue
+                logger.info(f"Created index {index.name}")
+    
+    for name in added:
+        logger.info(f"Added column {name}")
+    return added
+
+
+def _lock_schema(connection):
+    """Hold a database-wide lock until the transaction ends, where the database has one"""
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': SCHEMA_LOCK_KEY})
+
+
+def _has_column(connection, table_name, column_name):
+    # A fresh inspector: the upgrade's own one caches what it saw before the race
+    return column_name in {column['name'] for column in inspect(connection).get_columns(table_name)}
+
+
+def _has_index(connection, table_name, index_name):
+    return index_name in {index['name'] for index in inspect(connection).get_indexes(table_name)}
+
+
+def _remove_duplicates(connection, table, columns):
+    """Delete all but the lowest-ID row of each group of duplicate key values"""
+    keep = select(func.min(table.c.id)).group_by(*columns)
+    # Rows with a NULL key never conflict, so they are left alone
+    removed = connection.execute(
+        delete(table).where(
+            and_(*(column.isnot(None) for column in columns)),
+            table.c.id.not_in(keep)
+        )
+    ).rowcount
+    if removed:
+        names = ', '.join(column.name for column in columns)
+        logger.warning(f"Removed {removed} duplicate rows from {table.name} on ({names})")
+    return removed
@@ -29,6 +29,8 @@ class Server(db.Model):
     use_key_auth = db.Column(db.Boolean, default=True)
     status = db.Column(db.String(20), default='unknown')
     last_check = db.Column(db.DateTime, nullable=True)
+    # Deepest probe tier behind status ('tcp', 'banner' or 'auth'), for the status TTL cache
+    probe_level = db.Column(db.String(10), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     
     def to_dict(self):
@@ -64,15 +66,24 @@ class DockerHost(db.Model):
         }
 
 class Container(db.Model):
+    __table_args__ = (
+        # A Docker container appears once per host; also serves docker_host_id lookups
+        db.Index('uq_container_host_container_id', 'docker_host_id', 'container_id', unique=True),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     container_id = db.Column(db.String(64), nullable=False)
     name = db.Column(db.String(255), nullable=False)
     image = db.Column(db.String(255), nullable=False)
     status = db.Column(db.String(20), default='unknown')
+    labels = db.Column(db.Text, nullable=True)  # JSON object of Docker labels
     docker_host_id = db.Column(db.Integer, db.ForeignKey('docker_host.id'))
     docker_host = db.relationship('DockerHost', backref=db.backref('containers', lazy=True))
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     
+    def get_labels(self):
+        return json.loads(self.labels) if self.labels else {}
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -80,11 +91,17 @@ class Container(db.Model):
             'name': self.name,
             'image': self.image,
             'status': self.status,
+            'labels': self.get_labels(),
             'docker_host_id': self.docker_host_id,
             'docker_host_name': self.docker_host.name
         }
 
 class Experiment(db.Model):
+    __table_args__ = (
+        db.Index('ix_experiment_target', 'target_type', 'target_id'),
+        db.Index('ix_experiment_active_scheduled_time', 'active', 'scheduled_time'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text, nullable=True)
@@ -95,6 +112,10 @@ class Experiment(db.Model):
     scheduled_time = db.Column(db.DateTime, nullable=True)
     recurring_pattern = db.Column(db.String(100), nullable=True)  # cron expression for recurring
     job_id = db.Column(db.String(100), nullable=True)  # APScheduler job ID
+    # Load spreading for recurring schedules
+    jitter = db.Column(db.Integer, nullable=True)  # max random delay per run, in seconds
+    spread = db.Column(db.Boolean, nullable=True, default=False)  # offset runs by a stable hash within the interval
+    next_run_time = db.Column(db.DateTime, nullable=True, index=True)  # UTC, maintained by the scheduler leader
     active = db.Column(db.Boolean, default=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     user = db.relationship('User', backref=db.backref('experiments', lazy=True))
@@ -111,14 +132,22 @@ class Experiment(db.Model):
             'schedule_type': self.schedule_type,
             'scheduled_time': self.scheduled_time.isoformat() if self.scheduled_time else None,
             'recurring_pattern': self.recurring_pattern,
+            'jitter': self.jitter,
+            'spread': bool(self.spread),
+            'next_run_time': self.next_run_time.isoformat() if self.next_run_time else None,
             'active': self.active,
             'user_id': self.user_id,
             'created_at': self.created_at.isoformat()
         }
 
 class ExperimentLog(db.Model):
+    __table_args__ = (
+        # Keyset pagination on (execution_time, id); also serves execution_time ranges
+        db.Index('ix_experiment_log_execution_time_id', 'execution_time', 'id'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
-    experiment_id = db.Column(db.Integer, db.ForeignKey('experiment.id'))
+    experiment_id = db.Column(db.Integer, db.ForeignKey('experiment.id'), index=True)
     experiment = db.relationship('Experiment', backref=db.backref('logs', lazy=True))
     target_type = db.Column(db.String(20), nullable=False)
     target_id = db.Column(db.Integer, nullable=False)
@@ -127,6 +156,11 @@ class ExperimentLog(db.Model):
     status = db.Column(db.String(20), nullable=False)  # 'success' or 'failure'
     details = db.Column(db.Text, nullable=True)
     execution_time = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    # Outage tracking for server faults, filled in by the RecoveryWatcher
+    recovery_status = db.Column(db.String(20), nullable=True)  # 'pending', 'recovered', 'down', 'timeout', 'abandoned'
+    time_to_down = db.Column(db.Float, nullable=True)  # seconds from fault to host unreachable
+    time_to_recover = db.Column(db.Float, nullable=True)  # seconds from fault to SSH reachable again
+    recovered_at = db.Column(db.DateTime, nullable=True)
     
     def to_dict(self):
         return {
@@ -138,5 +172,96 @@ class ExperimentLog(db.Model):
             'action': self.action,
             'status': self.status,
             'details': self.details,
-            'execution_time': self.execution_time.isoformat()
+            'execution_time': self.execution_time.isoformat(),
+            'recovery_status': self.recovery_status,
+            'time_to_down': self.time_to_down,
+            'time_to_recover': self.time_to_recover,
+            'recovered_at': self.recovered_at.isoformat() if self.recovered_at else None
         }
+
+class SchedulerLease(db.Model):
+    """Lease row held by the process currently running the scheduler"""
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(255), nullable=False)  # hostname:pid:token of the leader
+    expires_at = db.Column(db.DateTime, nullable=False)
+    renewed_at = db.Column(db.DateTime, nullable=False)
+
+class ScheduleChange(db.Model):
+    """Outbox of experiments whose schedule the leader must re-apply"""
+    id = db.Column(db.Integer, primary_key=True)
+    experiment_id = db.Column(db.Integer, nullable=False)
+    job_id = db.Column(db.String(100), nullable=True)  # job to drop, if it had a different ID
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+class ExperimentRun(db.Model):
+    """Queued experiment run, claimed by worker processes under a lease"""
+    __table_args__ = (
+        db.Index('ix_experiment_run_status_due_at', 'status', 'due_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    experiment_id = db.Column(db.Integer, nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # 'queued', 'running', 'done', 'failed'
+    due_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    worker_id = db.Column(db.String(255), nullable=True)
+    lease_token = db.Column(db.String(32), nullable=True, index=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    log_id = db.Column(db.Integer, nullable=True)  # ExperimentLog written by the run
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'experiment_id': self.experiment_id,
+            'status': self.status,
+            'due_at': self.due_at.isoformat(),
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'worker_id': self.worker_id,
+            'lease_expires_at': self.lease_expires_at.isoformat() if self.lease_expires_at else None,
+            'log_id': self.log_id,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class LogRollupMixin:
+    """Count of ExperimentLog rows per time bucket, target, action and status"""
+    id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.DateTime, nullable=False)  # UTC start of the hour or day
+    target_type = db.Column(db.String(20), nullable=False)
+    target_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(20), nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'bucket': self.bucket.isoformat(),
+            'target_type': self.target_type,
+            'target_id': self.target_id,
+            'action': self.action,
+            'status': self.status,
+            'count': self.count
+        }
+
+class ExperimentLogHourly(LogRollupMixin, db.Model):
+    __tablename__ = 'experiment_log_hourly'
+    __table_args__ = (
+        db.Index('uq_experiment_log_hourly_key', 'bucket', 'target_type', 'target_id', 'action', 'status', unique=True),
+    )
+
+class ExperimentLogDaily(LogRollupMixin, db.Model):
+    __tablename__ = 'experiment_log_daily'
+    __table_args__ = (
+        db.Index('uq_experiment_log_daily_key', 'bucket', 'target_type', 'target_id', 'action', 'status', unique=True),
+    )
+
+class MaintenanceMarker(db.Model):
+    """One-time maintenance steps that have completed, by name"""
+    name = db.Column(db.String(50), primary_key=True)
+    completed_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
@@ -0,0 +1,243 @@
+import asyncio
+import atexit
+import datetime
+import logging
+import threading
+import time
+from sqlalchemy import update
+from ssh_manager import server_target
+from async_engine import engine as default_engine
+from models import ExperimentLog
+
+logger = logging.getLogger(__name__)
+
+class RecoveryWatcher:
+    """
+    Measures how long servers take to go down and come back after a fault.
+    
+    Each watched server is a coroutine on the async chaos engine that probes
+    the host and sleeps between probes, so watching a host through a long
+    reboot never occupies a scheduler or request thread. Probes start
+    frequent and back off exponentially while a host stays down. Results are
+    written to the ExperimentLog row that recorded the fault.
+    
+    Watches do not survive the process: stop() (run at exit) marks the logs
+    of unfinished watches 'abandoned', and sweep_stale() does the same for
+    watches lost to a crash.
+    """
+    
+    def __init__(self, engine=None, probe_level='banner', initial_interval=1, max_interval=10,
+                 down_timeout=300, recovery_timeout=1800):
+        self.engine = engine or default_engine
+        self.probe_level = probe_level
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.down_timeout = down_timeout
+        self.recovery_timeout = recovery_timeout
+        
+        self._lock = threading.Lock()
+        self._futures = {}  # Future -> ExperimentLog ID
+    
+    def watch(self, log_id, server, started_at=None, expect_recovery=True):
+        """
+        Start watching a server after a reboot or shutdown command
+        
+        Args:
+            log_id: ID of the ExperimentLog row to update
+            server: Server object (or ServerTarget) that received the fault
+            started_at: time.monotonic() when the fault was injected
+            expect_recovery: Wait for the host to come back (reboot) rather
+                             than only for it to go down (shutdown)
+        """
+        watch = _Watch(
+            log_id=log_id,
+            server=server_target(server),
+            started_at=started_at or time.monotonic(),
+            expect_recovery=expect_recovery
+        )
+        future = self.engine.submit(self._watch(watch))
+        with self._lock:
+            self._futures[future] = log_id
+        future.add_done_callback(self._forget)
+        logger.info(f"Watching {watch.server.hostname} for recovery (log {log_id})")
+    
+    def pending(self):
+        """
+        Returns:
+            int: Number of servers currently being watched
+        """
+        with self._lock:
+            return len(self._futures)
+    
+    def stop(self):
+        """
+        Abandon every pending watch
+        
+        Their logs are marked 'abandoned' unless a result was recorded first.
+        
+        Returns:
+            int: Number of logs marked abandoned
+        """
+        with self._lock:
+            watched = dict(self._futures)
+        for future in watched:
+            future.cancel()
+        if not watched:
+            return 0
+        
+        # Imported here to avoid circular imports
+        from app import app, db
+        
+        with app.app_context():
+            try:
+                abandoned = _abandon(ExperimentLog.id.in_(list(watched.values())))
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error abandoning recovery watches: {str(e)}")
+                return 0
+            finally:
+                db.session.remove()
+        logger.info(f"Abandoned {abandoned} recovery watches")
+        return abandoned
+    
+    def sweep_stale(self):
+        """
+        Mark pending recovery logs abandoned once no watch can still finish them
+        
+        Catches watches lost when a process died without running stop().
+        Must be called inside an app context; the caller commits.
+        
+        Returns:
+            int: Number of logs marked abandoned
+        """
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=self.down_timeout + self.recovery_timeout
+        )
+        with self._lock:
+            watched = list(self._futures.values())
+        return _abandon(ExperimentLog.execution_time < cutoff, ExperimentLog.id.notin_(watched))
+    
+    def _forget(self, future):
+        with self._lock:
+            self._futures.pop(future, None)
+    
+    async def _watch(self, watch):
+        interval = self.initial_interval
+        try:
+            # Poll quickly until the host drops so the moment is not missed
+            while True:
+                online = await self._probe(watch)
+                elapsed = time.monotonic() - watch.started_at
+                if not online:
+                    watch.down_after = elapsed
+                    break
+                if elapsed > self.down_timeout:
+                    return await self._record(watch, 'timeout')
+                await asyncio.sleep(self.initial_interval)
+            
+            logger.info(f"{watch.server.hostname} went down after {watch.down_after:.1f}s")
+            if not watch.expect_recovery:
+                return await self._record(watch, 'down')
+            await self._record(watch, 'pending')
+            
+            # Back off while the host is down
+            while True:
+                await asyncio.sleep(interval)
+                online = await self._probe(watch)
+                elapsed = time.monotonic() - watch.started_at
+                if online:
+                    watch.recover_after = elapsed
+                    logger.info(f"{watch.server.hostname} recovered after {elapsed:.1f}s")
+                    return await self._record(watch, 'recovered')
+                if elapsed > self.recovery_timeout:
+                    return await self._record(watch, 'timeout')
+                interval = min(interval * 2, self.max_interval)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Recovery watch for {watch.server.hostname} failed: {str(e)}")
+    
+    async def _probe(self, watch):
+        try:
+            result = await self.engine.probe(watch.server, self.probe_level)
+            return result['status'] == 'online'
+        except Exception as e:
+            logger.error(f"Recovery probe error for {watch.server.hostname}: {str(e)}")
+            return False
+    
+    async def _record(self, watch, status):
+        try:
+            await self.engine.db_call(_store_recovery, watch, status, self.probe_level)
+        except Exception as e:
+            logger.error(f"Error recording recovery for log {watch.log_id}: {str(e)}")
+
+
+def _abandon(*conditions):
+    """Set recovery_status 'abandoned' on pending logs matching the conditions"""
+    from app import db
+    
+    return db.session.execute(
+        update(ExperimentLog)
+        .where(ExperimentLog.recovery_status == 'pending', *conditions)
+        .values(recovery_status='abandoned')
+    ).rowcount
+
+
+def sweep_stale_recoveries():
+    """Scheduler job entry point: abandon pending recovery logs nothing is watching"""
+    from app import app, db
+    
+    with app.app_context():
+        try:
+            abandoned = recovery_watcher.sweep_stale()
+            db.session.commit()
+            if abandoned:
+                logger.info(f"Abandoned {abandoned} stale recovery watches")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Recovery sweep failed: {str(e)}")
+        finally:
+            db.session.remove()
+
+
+def _store_recovery(watch, status, probe_level):
+    from app import db
+    from models import Server
+    
+    log = db.session.get(ExperimentLog, watch.log_id)
+    if log is None:
+        logger.warning(f"Experiment log {watch.log_id} disappeared while watching recovery")
+        return
+    
+    log.recovery_status = status
+    log.time_to_down = watch.down_after
+    log.time_to_recover = watch.recover_after
+    if status == 'recovered':
+        log.recovered_at = datetime.datetime.utcnow()
+    
+    server = db.session.get(Server, watch.server.id)
+    if server is not None and (watch.down_after is not None or status == 'recovered'):
+        server.status = 'online' if status == 'recovered' else 'offline'
+        server.last_check = datetime.datetime.utcnow()
+        server.probe_level = probe_level
+    
+    db.session.commit()
+
+
+class _Watch:
+    __slots__ = ('log_id', 'server', 'started_at', 'expect_recovery', 'down_after', 'recover_after')
+    
+    def __init__(self, log_id, server, started_at, expect_recovery):
+        self.log_id = log_id
+        self.server = server
+        self.started_at = started_at
+        self.expect_recovery = expect_recovery
+        self.down_after = None
+        self.recover_after = None
+
+
+# Process-wide watcher shared by every ChaosManager instance; unfinished
+# watches are marked abandoned when the process exits
+recovery_watcher = RecoveryWatcher()
+atexit.register(recovery_watcher.stop)
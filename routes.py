@@ -9,6 +9,11 @@ from ssh_manager import SSHManager
 from docker_manager import DockerManager
 from scheduler import ChaosScheduler
 from chaos_manager import ChaosManager
+from docker_events import docker_event_monitor
+from experiment_queue import run_queue
+from log_history import MAX_HISTORY_DAYS, experiment_history, history_cache, log_page, log_summary
+from log_store import delete_logs, log_sink
+from sqlite_tuning import write_gate
 
 # Initialize managers
 chaos_scheduler = ChaosScheduler()
@@ -54,11 +59,11 @@ def register_routes(app):
         # Get recent logs
         recent_logs = ExperimentLog.query.order_by(ExperimentLog.execution_time.desc()).limit(10).all()
         
-        # Get upcoming experiments
+        # Get upcoming experiments (one-time and recurring) from the scheduler's next run times
         upcoming_experiments = Experiment.query.filter(
-            Experiment.scheduled_time > datetime.datetime.utcnow(),
+            Experiment.next_run_time.isnot(None),
             Experiment.active == True
-        ).order_by(Experiment.scheduled_time).limit(5).all()
+        ).order_by(Experiment.next_run_time).limit(5).all()
         
         return render_template(
             'index.html',
@@ -109,6 +114,7 @@ def register_routes(app):
             if ssh_manager.test_connection(server):
                 server.status = 'online'
                 server.last_check = datetime.datetime.utcnow()
+                server.probe_level = 'auth'
                 db.session.add(server)
                 db.session.commit()
                 flash(f'Server "{name}" added successfully', 'success')
@@ -128,7 +134,7 @@ def register_routes(app):
         # Delete related experiments
         experiments = Experiment.query.filter_by(target_type='server', target_id=server_id).all()
         for experiment in experiments:
-            chaos_scheduler.remove_job(experiment.job_id)
+            chaos_scheduler.unschedule_experiment(experiment)
             db.session.delete(experiment)
         
         db.session.delete(server)
@@ -142,15 +148,64 @@ def register_routes(app):
         server = Server.query.get_or_404(server_id)
         ssh_manager = SSHManager()
         
-        if ssh_manager.test_connection(server):
-            server.status = 'online'
-        else:
-            server.status = 'offline'
-            
-        server.last_check = datetime.datetime.utcnow()
-        db.session.commit()
+        # Cheap TCP + banner probe by default; ?level=auth forces a full login
+        level = request.args.get('level', 'banner')
+        if level not in SSHManager.PROBE_LEVELS:
+            return jsonify({'error': f'Unknown probe level: {level}'}), 400
+        force = request.args.get('force') in ('1', 'true')
         
-        return jsonify({'status': server.status})
+        result = ssh_manager.refresh_server_status(server, level=level, force=force)
+        if not result['cached']:
+            db.session.commit()
+        
+        return jsonify({
+            'status': server.status,
+            'level': result['level'],
+            'latency': result['latency'],
+            'error': result['error'],
+            'cached': result['cached'],
+            'last_check': server.last_check.isoformat() if server.last_check else None
+        })
+    
+    @app.route('/api/servers/status')
+    @login_required
+    def api_servers_status():
+        servers = Server.query.all()
+        ssh_manager = SSHManager()
+        level = request.args.get('level', 'banner')
+        if level not in SSHManager.PROBE_LEVELS:
+            return jsonify({'error': f'Unknown probe level: {level}'}), 400
+        
+        # Serve fresh statuses from the TTL cache and probe only the stale ones
+        statuses = {}
+        stale = []
+        for server in servers:
+            cached = ssh_manager.cached_status(server, level)
+            if cached is None:
+                stale.append(server)
+            else:
+                statuses[server.id] = cached
+        
+        if stale:
+            servers_by_id = {server.id: server for server in stale}
+            for result in ssh_manager.probe_servers(stale, level):
+                server = servers_by_id[result['server_id']]
+                ssh_manager.record_probe(server, result, level)
+                statuses[server.id] = dict(result, cached=False)
+            db.session.commit()
+        
+        return jsonify([
+            {
+                'id': server.id,
+                'name': server.name,
+                'status': server.status,
+                'level': statuses[server.id]['level'],
+                'latency': statuses[server.id]['latency'],
+                'cached': statuses[server.id]['cached'],
+                'last_check': server.last_check.isoformat() if server.last_check else None
+            }
+            for server in servers
+        ])
     
     @app.route('/servers/<int:server_id>/action', methods=['POST'])
     @login_required
@@ -163,7 +218,7 @@ def register_routes(app):
             if result['success']:
                 flash(f'Successfully executed {action} on server "{server.name}"', 'success')
                 
-                # Log the action
+                # Log the action; written directly since the recovery watcher needs its ID
                 log = ExperimentLog(
                     experiment_id=None,
                     target_type='server',
@@ -171,31 +226,58 @@ def register_routes(app):
                     target_name=server.name,
                     action=action,
                     status='success',
-                    details=result.get('message', '')
+                    details=result.get('message', ''),
+                    recovery_status='pending' if 'started_at' in result else None
                 )
                 db.session.add(log)
                 db.session.commit()
+                chaos_manager.track_recovery(log, server, result)
             else:
                 flash(f'Failed to execute {action} on server: {result["message"]}', 'danger')
                 
                 # Log the failure
-                log = ExperimentLog(
-                    experiment_id=None,
-                    target_type='server',
-                    target_id=server.id,
-                    target_name=server.name,
-                    action=action,
-                    status='failure',
-                    details=result.get('message', '')
-                )
-                db.session.add(log)
-                db.session.commit()
+                log_sink.submit({
+                    'experiment_id': None,
+                    'target_type': 'server',
+                    'target_id': server.id,
+                    'target_name': server.name,
+                    'action': action,
+                    'status': 'failure',
+                    'details': result.get('message', '')
+                })
                 
         except Exception as e:
             flash(f'Error executing action: {str(e)}', 'danger')
             
         return redirect(url_for('servers'))
     
+    @app.route('/servers/bulk-action', methods=['POST'])
+    @login_required
+    def bulk_server_action():
+        action = request.form.get('action')
+        
+        try:
+            servers = chaos_manager.select_servers(
+                name_pattern=request.form.get('name_pattern') or None,
+                hostname_pattern=request.form.get('hostname_pattern') or None
+            )
+            if not servers:
+                flash('No servers match the selector', 'warning')
+                return redirect(url_for('servers'))
+            
+            result = chaos_manager.execute_bulk_server_action(
+                servers,
+                action,
+                parallelism=int(request.form.get('parallelism') or 5),
+                percentage=float(request.form.get('percentage') or 100)
+            )
+            flash(result['message'], 'success' if result['success'] else 'warning')
+            
+        except Exception as e:
+            flash(f'Error executing bulk action: {str(e)}', 'danger')
+            
+        return redirect(url_for('servers'))
+    
     # Container management routes
     @app.route('/docker-hosts')
     @login_required
@@ -227,8 +309,9 @@ def register_routes(app):
                 db.session.add(host)
                 db.session.commit()
                 
-                # Fetch containers
+                # Fetch containers and follow their state changes
                 docker_manager.refresh_containers(host)
+                docker_event_monitor.watch_host(host)
                 
                 flash(f'Docker host "{name}" added successfully', 'success')
             else:
@@ -243,6 +326,7 @@ def register_routes(app):
     @login_required
     def delete_docker_host(host_id):
         host = DockerHost.query.get_or_404(host_id)
+        docker_event_monitor.unwatch_host(host_id)
         
         # Delete related containers
         Container.query.filter_by(docker_host_id=host_id).delete()
@@ -252,7 +336,7 @@ def register_routes(app):
         for container in containers:
             experiments = Experiment.query.filter_by(target_type='container', target_id=container.id).all()
             for experiment in experiments:
-                chaos_scheduler.remove_job(experiment.job_id)
+                chaos_scheduler.unschedule_experiment(experiment)
                 db.session.delete(experiment)
         
         db.session.delete(host)
@@ -276,6 +360,28 @@ def register_routes(app):
             
         return redirect(url_for('docker_hosts'))
     
+    @app.route('/docker-hosts/refresh-all', methods=['POST'])
+    @login_required
+    def refresh_all_containers():
+        hosts = DockerHost.query.all()
+        started = datetime.datetime.utcnow()
+        
+        summary = DockerManager().refresh_all_hosts(hosts)
+        
+        elapsed = (datetime.datetime.utcnow() - started).total_seconds()
+        refreshed = [result for result in summary if result['success']]
+        failed = [result for result in summary if not result['success']]
+        changed = sum(result['added'] + result['updated'] + result['removed'] for result in refreshed)
+        
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({'elapsed': elapsed, 'hosts': summary})
+        
+        flash(f'Refreshed {len(refreshed)} of {len(summary)} Docker hosts in {elapsed:.1f}s '
+              f'({changed} containers changed)', 'success' if not failed else 'warning')
+        for result in failed:
+            flash(f'Failed to refresh "{result["name"]}": {result["error"]}', 'danger')
+        return redirect(url_for('docker_hosts'))
+    
     @app.route('/containers/<int:container_id>/action', methods=['POST'])
     @login_required
     def container_action(container_id):
@@ -288,38 +394,70 @@ def register_routes(app):
                 flash(f'Successfully executed {action} on container "{container.name}"', 'success')
                 
                 # Log the action
-                log = ExperimentLog(
-                    experiment_id=None,
-                    target_type='container',
-                    target_id=container.id,
-                    target_name=container.name,
-                    action=action,
-                    status='success',
-                    details=result.get('message', '')
-                )
-                db.session.add(log)
-                db.session.commit()
+                log_sink.submit({
+                    'experiment_id': None,
+                    'target_type': 'container',
+                    'target_id': container.id,
+                    'target_name': container.name,
+                    'action': action,
+                    'status': 'success',
+                    'details': result.get('message', '')
+                })
             else:
                 flash(f'Failed to execute {action} on container: {result["message"]}', 'danger')
                 
                 # Log the failure
-                log = ExperimentLog(
-                    experiment_id=None,
-                    target_type='container',
-                    target_id=container.id,
-                    target_name=container.name,
-                    action=action,
-                    status='failure',
-                    details=result.get('message', '')
-                )
-                db.session.add(log)
-                db.session.commit()
+                log_sink.submit({
+                    'experiment_id': None,
+                    'target_type': 'container',
+                    'target_id': container.id,
+                    'target_name': container.name,
+                    'action': action,
+                    'status': 'failure',
+                    'details': result.get('message', '')
+                })
                 
         except Exception as e:
             flash(f'Error executing action: {str(e)}', 'danger')
             
         return redirect(url_for('docker_hosts'))
     
+    @app.route('/containers/bulk-action', methods=['POST'])
+    @login_required
+    def bulk_container_action():
+        action = request.form.get('action')
+        
+        try:
+            docker_host_id = request.form.get('docker_host_id')
+            labels = {}
+            for selector in (request.form.get('labels') or '').split(','):
+                key, sep, value = selector.strip().partition('=')
+                if key:
+                    labels[key.strip()] = value.strip() if sep else None
+            
+            containers = chaos_manager.select_containers(
+                image=request.form.get('image') or None,
+                name_pattern=request.form.get('name_pattern') or None,
+                labels=labels or None,
+                docker_host_id=int(docker_host_id) if docker_host_id else None
+            )
+            if not containers:
+                flash('No containers match the selector', 'warning')
+                return redirect(url_for('docker_hosts'))
+            
+            result = chaos_manager.execute_bulk_container_action(
+                containers,
+                action,
+                parallelism=int(request.form.get('parallelism') or 5),
+                percentage=float(request.form.get('percentage') or 100)
+            )
+            flash(result['message'], 'success' if result['success'] else 'warning')
+            
+        except Exception as e:
+            flash(f'Error executing bulk action: {str(e)}', 'danger')
+            
+        return redirect(url_for('docker_hosts'))
+    
     # Experiment management routes
     @app.route('/experiments')
     @login_required
@@ -353,6 +491,10 @@ def register_routes(app):
                 scheduled_time = None
                 recurring_pattern = request.form.get('recurring_pattern')
             
+            # Load spreading applies to recurring schedules only
+            jitter = int(request.form.get('jitter') or 0) if schedule_type == 'recurring' else 0
+            spread = schedule_type == 'recurring' and request.form.get('spread') == '1'
+            
             experiment = Experiment(
                 name=name,
                 description=description,
@@ -362,6 +504,8 @@ def register_routes(app):
                 schedule_type=schedule_type,
                 scheduled_time=scheduled_time,
                 recurring_pattern=recurring_pattern,
+                jitter=jitter or None,
+                spread=spread,
                 active=True,
                 user_id=current_user.id
             )
@@ -394,7 +538,7 @@ def register_routes(app):
             flash(f'Experiment "{experiment.name}" activated', 'success')
         else:
             # Remove from scheduler
-            chaos_scheduler.remove_job(experiment.job_id)
+            chaos_scheduler.unschedule_experiment(experiment)
             flash(f'Experiment "{experiment.name}" deactivated', 'success')
             
         db.session.commit()
@@ -406,11 +550,10 @@ def register_routes(app):
         experiment = Experiment.query.get_or_404(experiment_id)
         
         # Remove from scheduler
-        if experiment.job_id:
-            chaos_scheduler.remove_job(experiment.job_id)
+        chaos_scheduler.unschedule_experiment(experiment)
         
-        # Delete logs
-        ExperimentLog.query.filter_by(experiment_id=experiment_id).delete()
+        # Delete logs, and their counts in the rollups
+        delete_logs(ExperimentLog.experiment_id == experiment_id)
         
         # Delete experiment
         db.session.delete(experiment)
@@ -423,33 +566,56 @@ def register_routes(app):
     @app.route('/reports')
     @login_required
     def reports():
-        # Get execution logs
-        logs = ExperimentLog.query.order_by(ExperimentLog.execution_time.desc()).all()
-        
-        # Success rate
-        total_logs = len(logs)
-        successful_logs = len([log for log in logs if log.status == 'success'])
-        success_rate = (successful_logs / total_logs * 100) if total_logs > 0 else 0
+        # Filters: ?status=, ?action=, ?target=server|container with an optional
+        # ?target_id= (the older ?target=server:<id> form is still accepted)
+        filters = {
+            'status': request.args.get('status') or None,
+            'action': request.args.get('action') or None,
+        }
+        target_type, _, target_id = request.args.get('target', '').partition(':')
+        target_id = request.args.get('target_id', '').strip() or target_id
+        target_name = None
+        if target_type in ('server', 'container'):
+            filters['target_type'] = target_type
+            filters['target_id'] = int(target_id) if target_id.isdigit() else None
+            # Name the filtered target with a single lookup, not a list of every host
+            if filters['target_id'] is not None:
+                row = db.session.get(Server if target_type == 'server' else Container, filters['target_id'])
+                target_name = row.name if row else None
+        filter_args = {
+            name: value for name, value in (
+                ('status', filters['status']),
+                ('action', filters['action']),
+                ('target', filters.get('target_type')),
+                ('target_id', filters.get('target_id')),
+            ) if value
+        }
         
-        # Get stats by target type
-        server_logs = [log for log in logs if log.target_type == 'server']
-        container_logs = [log for log in logs if log.target_type == 'container']
-        
-        # Get stats by action
-        stop_logs = [log for log in logs if log.action == 'stop']
-        start_logs = [log for log in logs if log.action == 'start']
-        restart_logs = [log for log in logs if log.action == 'restart']
+        # Summary from one aggregate query, logs one keyset page at a time
+        summary = history_cache.get(
+            ('summary',) + tuple(sorted(filters.items())),
+            lambda: log_summary(filters)
+        )
+        per_page = max(1, min(request.args.get('per_page', 50, type=int), 200))
+        page = log_page(
+            filters,
+            before=request.args.get('before'),
+            after=request.args.get('after'),
+            per_page=per_page
+        )
+        # Page links keep a non-default page size along with the filters
+        page_args = dict(filter_args, per_page=per_page) if per_page != 50 else filter_args
         
         return render_template(
             'reports.html',
-            logs=logs,
-            total_logs=total_logs,
-            success_rate=success_rate,
-            server_logs=server_logs,
-            container_logs=container_logs,
-            stop_logs=stop_logs,
-            start_logs=start_logs,
-            restart_logs=restart_logs
+            logs=page['logs'],
+            next_cursor=page['next_cursor'],
+            prev_cursor=page['prev_cursor'],
+            summary=summary,
+            filter_args=filter_args,
+            page_args=page_args,
+            per_page=per_page,
+            target_name=target_name
         )
     
     # Settings
@@ -513,46 +679,24 @@ def register_routes(app):
     @app.route('/api/experiments/history/<int:days>')
     @login_required
     def api_experiment_history(days):
-        # Get logs for the specified period
-        end_date = datetime.datetime.utcnow()
-        start_date = end_date - datetime.timedelta(days=days)
+        # Aggregated from the log rollups; cached briefly since every page view asks
+        days = max(1, min(days, MAX_HISTORY_DAYS))
+        history = history_cache.get(days, lambda: experiment_history(days))
         
-        logs = ExperimentLog.query.filter(
-            ExperimentLog.execution_time >= start_date,
-            ExperimentLog.execution_time <= end_date
-        ).all()
-        
-        # Prepare data for chart
-        dates = []
-        success_counts = []
-        failure_counts = []
-        
-        # Create a date range
-        current_date = start_date
-        while current_date <= end_date:
-            date_str = current_date.strftime('%Y-%m-%d')
-            dates.append(date_str)
-            
-            # Count successes and failures for this date
-            day_logs = [log for log in logs if log.execution_time.strftime('%Y-%m-%d') == date_str]
-            success_counts.append(len([log for log in day_logs if log.status == 'success']))
-            failure_counts.append(len([log for log in day_logs if log.status == 'failure']))
-            
-            current_date += datetime.timedelta(days=1)
-            
         return jsonify({
-            'labels': dates,
+            'labels': history['labels'],
+            'bucket': history['bucket'],
             'datasets': [
                 {
                     'label': 'Successful',
-                    'data': success_counts,
+                    'data': history['success'],
                     'backgroundColor': 'rgba(40, 167, 69, 0.6)',
                     'borderColor': 'rgba(40, 167, 69, 1)',
                     'borderWidth': 1
                 },
                 {
                     'label': 'Failed',
-                    'data': failure_counts,
+                    'data': history['failure'],
                     'backgroundColor': 'rgba(220, 53, 69, 0.6)',
                     'borderColor': 'rgba(220, 53, 69, 1)',
                     'borderWidth': 1
@@ -560,6 +704,48 @@ def register_routes(app):
             ]
         })
     
+    @app.route('/api/experiments/upcoming')
+    @login_required
+    def api_upcoming_experiments():
+        # ?within=<seconds> limits to runs in that window, ?limit caps the count
+        limit = min(request.args.get('limit', 20, type=int), 500)
+        query = Experiment.query.filter(
+            Experiment.next_run_time.isnot(None),
+            Experiment.active == True
+        )
+        within = request.args.get('within', type=int)
+        if within is not None:
+            end = datetime.datetime.utcnow() + datetime.timedelta(seconds=within)
+            query = query.filter(Experiment.next_run_time <= end)
+        
+        experiments = query.order_by(Experiment.next_run_time).limit(limit).all()
+        return jsonify([experiment.to_dict() for experiment in experiments])
+    
+    @app.route('/api/metrics/experiment-runs')
+    @login_required
+    def api_experiment_run_metrics():
+        return jsonify(run_queue.stats())
+    
+    @app.route('/api/metrics/log-sink')
+    @login_required
+    def api_log_sink_metrics():
+        return jsonify(log_sink.stats())
+    
+    @app.route('/api/metrics/write-gate')
+    @login_required
+    def api_write_gate_metrics():
+        return jsonify(write_gate.stats())
+    
+    @app.route('/api/metrics/target-locks')
+    @login_required
+    def api_target_lock_metrics():
+        return jsonify(chaos_manager.get_lock_metrics())
+    
+    @app.route('/api/metrics/history-cache')
+    @login_required
+    def api_history_cache_metrics():
+        return jsonify(history_cache.stats())
+    
     # First-time setup route
     @app.route('/setup', methods=['GET', 'POST'])
     def setup():
@@ -582,3 +768,8 @@ def register_routes(app):
             return redirect(url_for('login'))
             
         return render_template('setup.html')
+    
+    # Run the scheduler, and the Docker event monitor with it, in whichever
+    # process wins the leader election
+    if app.config.get('SCHEDULER_ENABLED'):
+        chaos_scheduler.start(app)
@@ -1,65 +1,437 @@
+import atexit
+import hashlib
 import logging
+import re
+import socket
+import threading
+import time
+import uuid
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.events import (
+    EVENT_JOB_ADDED, EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_MAX_INSTANCES,
+    EVENT_JOB_MISSED, EVENT_JOB_MODIFIED, EVENT_JOB_REMOVED, EVENT_JOB_SUBMITTED
+)
+from apscheduler.triggers.base import BaseTrigger
 from apscheduler.triggers.date import DateTrigger
 from apscheduler.triggers.cron import CronTrigger
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import os
+from sqlalchemy import delete, insert, or_, update
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from async_engine import engine
+from docker_events import docker_event_monitor
+from experiment_queue import run_queue
+from log_retention import run_log_retention
+from recovery_watcher import sweep_stale_recoveries
+from models import Experiment, ScheduleChange, SchedulerLease
 
 logger = logging.getLogger(__name__)
 
+# Job events after which an experiment's next run time may have changed
+NEXT_RUN_EVENTS = (
+    EVENT_JOB_ADDED | EVENT_JOB_MODIFIED | EVENT_JOB_REMOVED | EVENT_JOB_SUBMITTED |
+    EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES
+)
+
+# Housekeeping jobs run by the leader, left alone by reconcile
+MAINTENANCE_JOB_IDS = {'log_retention', 'recovery_sweep'}
+
+JOB_ID_PATTERN = re.compile(r'^experiment_(\d+)(?:_\d+)?$')
+
+def run_experiment(experiment_id):
+    """
+    Scheduler job entry point: run an experiment by ID
+    
+    Jobs store only the experiment ID; the row and its target are reloaded in
+    a fresh session when the run executes. With EXECUTION_QUEUE_ENABLED the
+    run is queued for worker processes (see worker.py); otherwise it is
+    handed to the local async engine without waiting, so scheduler threads
+    are not held for the duration of the fault.
+    
+    Args:
+        experiment_id: ID of the Experiment to run
+    """
+    if app.config.get('EXECUTION_QUEUE_ENABLED'):
+        with app.app_context():
+            try:
+                run_id = run_queue.enqueue(experiment_id)
+                logger.info(f"Queued run {run_id} of experiment {experiment_id}")
+            finally:
+                db.session.remove()
+        return
+    
+    future = engine.submit(engine.execute_experiment(experiment_id))
+    
+    def report(done):
+        if done.exception() is not None:
+            logger.error(f"Scheduled run of experiment {experiment_id} failed: {done.exception()}")
+    
+    future.add_done_callback(report)
+
+def _utc_naive(moment):
+    """Convert an aware datetime to the naive UTC form stored in the database"""
+    if moment is None:
+        return None
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class OffsetTrigger(BaseTrigger):
+    """
+    Fires a fixed number of seconds after each fire time of another trigger
+    
+    Args:
+        trigger: Wrapped trigger
+        offset: Offset in seconds
+    """
+    
+    def __init__(self, trigger, offset):
+        self.trigger = trigger
+        self.offset = timedelta(seconds=offset)
+    
+    def get_next_fire_time(self, previous_fire_time, now):
+        # Ask the wrapped trigger in its own (unshifted) timeline
+        previous = previous_fire_time - self.offset if previous_fire_time else None
+        next_fire_time = self.trigger.get_next_fire_time(previous, now - self.offset)
+        return next_fire_time + self.offset if next_fire_time else None
+    
+    def __str__(self):
+        return f"{self.trigger} +{int(self.offset.total_seconds())}s"
+
+
+def spread_offset(experiment_id, trigger, samples=5):
+    """
+    Stable offset that places an experiment within its trigger's interval
+    
+    The experiment ID is hashed onto [0, interval), where the interval is the
+    shortest gap between the trigger's next few fire times, so experiments on
+    the same schedule are spread evenly instead of firing together.
+    
+    Args:
+        experiment_id: ID of the Experiment
+        trigger: Trigger the offset will be applied to
+        samples: Number of upcoming fire times used to measure the interval
+        
+    Returns:
+        int: Offset in seconds
+    """
+    fire_times = []
+    fire_time = trigger.get_next_fire_time(None, datetime.now(trigger.timezone))
+    while fire_time is not None and len(fire_times) < samples:
+        fire_times.append(fire_time)
+        fire_time = trigger.get_next_fire_time(fire_time, fire_time)
+    
+    gaps = [(later - earlier).total_seconds() for earlier, later in zip(fire_times, fire_times[1:])]
+    interval = int(min(gaps)) if gaps else 0
+    if interval <= 1:
+        return 0
+    
+    digest = hashlib.sha256(f"experiment:{experiment_id}".encode()).digest()
+    return int.from_bytes(digest[:8], 'big') % interval
+
+
 class ChaosScheduler:
     """
     Scheduler for chaos experiments using APScheduler
+    
+    Only one process runs the APScheduler instance at a time. Every process
+    that calls start() takes part in a leader election through a lease row
+    in the database (SchedulerLease): the holder runs the scheduler and keeps
+    renewing the lease, and another process takes over once it expires.
+    
+    Web workers never touch the job store. schedule_experiment() and
+    unschedule_experiment() add a ScheduleChange row to the caller's session;
+    the leader re-applies those experiments from the database on its next
+    poll, and periodically reconciles every job against the Experiment table.
+    
+    The leader mirrors each job's next fire time into the indexed
+    Experiment.next_run_time column, driven by job events, so upcoming runs
+    can be queried without asking APScheduler.
+    
+    Recurring experiments can add random jitter and/or a stable offset within
+    their interval (OffsetTrigger), and the engine caps how many runs start
+    per second, so shared schedules don't fire everything at once.
+    
+    Jobs call the module-level run_experiment() with the experiment ID only,
+    so the job store never holds pickled ORM objects or managers.
     """
     
-    def __init__(self):
-        # Configure job stores and executors
+    LEASE_NAME = 'chaos-scheduler'
+    
+    def __init__(self, lease_ttl=30, poll_interval=2, reconcile_interval=300, host_sync_interval=30):
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.reconcile_interval = reconcile_interval
+        self.host_sync_interval = host_sync_interval
+        
+        self.holder = None
+        self.scheduler = None
+        self._app = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._lease_deadline = 0
+        self._renew_at = 0
+        self._last_reconcile = 0
+        self._last_host_sync = 0
+        self._dirty_lock = threading.Lock()
+        self._dirty = set()  # experiment IDs whose next_run_time needs refreshing
+    
+    @property
+    def is_leader(self):
+        """Whether this process currently runs the scheduler"""
+        return self.scheduler is not None
+    
+    @staticmethod
+    def job_id_for(experiment_id):
+        """Job ID used for an experiment"""
+        return f"experiment_{experiment_id}"
+    
+    @staticmethod
+    def experiment_id_for(job_id):
+        """Experiment ID of a job, or None for jobs that aren't experiments"""
+        match = JOB_ID_PATTERN.match(job_id or '')
+        return int(match.group(1)) if match else None
+    
+    # Web side
+    
+    def schedule_experiment(self, experiment):
+        """
+        Schedule a chaos experiment
+        
+        Queues the change for the leader; it takes effect once the caller's
+        session is committed.
+        
+        Args:
+            experiment: Experiment object
+            
+        Returns:
+            str: Job ID the leader will use for the experiment
+        """
+        if not experiment.active:
+            logger.info(f"Experiment {experiment.name} is inactive, not scheduling")
+            return None
+        
+        self._request_sync(experiment)
+        return self.job_id_for(experiment.id)
+    
+    def unschedule_experiment(self, experiment):
+        """
+        Remove an experiment's job
+        
+        Queues the change for the leader; call after deactivating or deleting
+        the experiment, before the caller's session is committed.
+        
+        Args:
+            experiment: Experiment object
+        """
+        self._request_sync(experiment)
+    
+    def _request_sync(self, experiment):
+        db.session.add(ScheduleChange(experiment_id=experiment.id, job_id=experiment.job_id))
+    
+    # Leader election
+    
+    def start(self, app):
+        """
+        Take part in the scheduler leader election
+        
+        Args:
+            app: Flask app, used for database access from the election thread
+        """
+        if self._thread is not None:
+            return
+        self._app = app
+        # Built here rather than in __init__ so forked workers get their own
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._thread = threading.Thread(target=self._run, name='scheduler-election', daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+        logger.info(f"Scheduler election started as {self.holder}")
+    
+    def _run(self):
+        while not self._stopped.is_set():
+            with self._app.app_context():
+                try:
+                    self._tick()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Scheduler election error: {str(e)}")
+                    # Stop firing jobs once the lease can no longer be vouched for
+                    if self.is_leader and time.monotonic() >= self._lease_deadline:
+                        self._step_down()
+                finally:
+                    db.session.remove()
+            self._stopped.wait(self.poll_interval if self.is_leader else self.lease_ttl / 3)
+    
+    def _tick(self):
+        if self.is_leader and time.monotonic() < self._renew_at:
+            held = True
+        else:
+            held = self._acquire_lease()
+        
+        if not held:
+            if self.is_leader:
+                logger.warning("Scheduler lease taken over by another process")
+                self._step_down()
+            return
+        
+        if not self.is_leader:
+            self._become_leader()
+        self._apply_changes()
+        if time.monotonic() - self._last_reconcile >= self.reconcile_interval:
+            self.reconcile()
+        if time.monotonic() - self._last_host_sync >= self.host_sync_interval:
+            docker_event_monitor.sync_hosts()
+            self._last_host_sync = time.monotonic()
+        self._sync_next_run_times()
+    
+    def _acquire_lease(self):
+        """Take or renew the lease; True if this process holds it afterwards"""
+        started = time.monotonic()
+        now = datetime.utcnow()
+        values = {
+            'holder': self.holder,
+            'expires_at': now + timedelta(seconds=self.lease_ttl),
+            'renewed_at': now
+        }
+        
+        renewed = db.session.execute(
+            update(SchedulerLease)
+            .where(SchedulerLease.name == self.LEASE_NAME)
+            .where(or_(SchedulerLease.holder == self.holder, SchedulerLease.expires_at < now))
+            .values(**values)
+        ).rowcount
+        
+        if not renewed:
+            if db.session.get(SchedulerLease, self.LEASE_NAME) is not None:
+                db.session.rollback()
+                return False
+            try:
+                db.session.execute(insert(SchedulerLease).values(name=self.LEASE_NAME, **values))
+            except IntegrityError:
+                # Another process created the lease first
+                db.session.rollback()
+                return False
+        
+        db.session.commit()
+        self._lease_deadline = started + self.lease_ttl
+        self._renew_at = started + self.lease_ttl / 3
+        return True
+    
+    def _release_lease(self):
+        db.session.execute(
+            update(SchedulerLease)
+            .where(SchedulerLease.name == self.LEASE_NAME, SchedulerLease.holder == self.holder)
+            .values(expires_at=datetime.utcnow())
+        )
+        db.session.commit()
+    
+    def _become_leader(self):
+        # Configure job stores and executors; jobs live in the application
+        # database (sharing its connection pool) unless configured otherwise
+        jobstore_url = self._app.config.get('SCHEDULER_JOBSTORE_URL')
         jobstores = {
-            'default': SQLAlchemyJobStore(url='sqlite:///chaos_engineering.db')
+            'default': SQLAlchemyJobStore(url=jobstore_url) if jobstore_url else SQLAlchemyJobStore(engine=db.engine)
         }
         executors = {
-            'default': ThreadPoolExecutor(20)
+            'default': ThreadPoolExecutor(self._app.config.get('SCHEDULER_THREADS', 20))
         }
         job_defaults = {
             'coalesce': False,
             'max_instances': 3
         }
         
-        # Create scheduler
         self.scheduler = BackgroundScheduler(
             jobstores=jobstores,
             executors=executors,
             job_defaults=job_defaults
         )
         
-        # Start scheduler
-        self.scheduler.start()
-        logger.info("Chaos scheduler started")
+        self.scheduler.add_listener(self._on_job_event, NEXT_RUN_EVENTS)
+        
+        # Start paused so stored jobs can be reconciled before any of them fire.
+        # Reconcile also replaces jobs from before run_experiment, which pickled
+        # the Experiment row: they name no experiment ID, so they are removed
+        # and recreated from the active experiments
+        self.scheduler.start(paused=True)
+        self.reconcile()
+        
+        # Daily log archival and rollup maintenance; also runs once on election
+        self.scheduler.add_job(
+            run_log_retention,
+            trigger=CronTrigger(hour=3, minute=17),
+            id='log_retention',
+            name='Log retention',
+            replace_existing=True,
+            next_run_time=datetime.now(timezone.utc)
+        )
+        # Recovery logs left pending by processes that died mid-watch
+        self.scheduler.add_job(
+            sweep_stale_recoveries,
+            trigger='interval',
+            minutes=10,
+            id='recovery_sweep',
+            name='Recovery sweep',
+            replace_existing=True,
+            next_run_time=datetime.now(timezone.utc)
+        )
+        self.scheduler.resume()
+        logger.info(f"Elected scheduler leader ({self.holder}), chaos scheduler started")
+        
+        # Follow the Docker event streams from this process only
+        if self._app.config.get('DOCKER_EVENTS_ENABLED'):
+            docker_event_monitor.start(self._app)
+            self._last_host_sync = time.monotonic()
     
-    def schedule_experiment(self, experiment):
+    def _step_down(self):
+        scheduler, self.scheduler = self.scheduler, None
+        if scheduler is not None:
+            scheduler.shutdown(wait=False)
+            docker_event_monitor.stop()
+            logger.info("Chaos scheduler stopped, no longer leader")
+    
+    # Leader side
+    
+    def _apply_changes(self, batch_size=500):
+        changes = ScheduleChange.query.order_by(ScheduleChange.id).limit(batch_size).all()
+        if not changes:
+            return
+        
+        # Several changes to one experiment collapse into one re-apply
+        stale_job_ids = {}
+        for change in changes:
+            job_ids = stale_job_ids.setdefault(change.experiment_id, set())
+            if change.job_id:
+                job_ids.add(change.job_id)
+        
+        for experiment_id, job_ids in stale_job_ids.items():
+            self.apply_experiment(experiment_id, job_ids)
+        
+        db.session.execute(delete(ScheduleChange).where(ScheduleChange.id <= changes[-1].id))
+        db.session.commit()
+    
+    def apply_experiment(self, experiment_id, stale_job_ids=()):
         """
-        Schedule a chaos experiment
+        Bring an experiment's job in line with its row (leader only)
         
         Args:
-            experiment: Experiment object
-            
-        Returns:
-            str: Job ID
+            experiment_id: ID of the Experiment
+            stale_job_ids: Older job IDs of the experiment to remove
         """
-        if not experiment.active:
-            logger.info(f"Experiment {experiment.name} is inactive, not scheduling")
-            return None
-            
-        # Import here to avoid circular imports
-        from chaos_manager import ChaosManager
-        chaos_manager = ChaosManager()
-        
-        # Remove existing job if it exists
-        if experiment.job_id:
-            self.remove_job(experiment.job_id)
+        job_id = self.job_id_for(experiment_id)
+        for stale in stale_job_ids:
+            if stale != job_id:
+                self.remove_job(stale)
         
+        experiment = db.session.get(Experiment, experiment_id)
+        if experiment is None or not experiment.active:
+            self.remove_job(job_id)
+        else:
+            self._add_job(experiment)
+    
+    def _add_job(self, experiment):
         # Determine trigger type
         if experiment.schedule_type == 'one_time':
             if experiment.scheduled_time <= datetime.utcnow():
@@ -76,17 +448,24 @@ class ChaosScheduler:
                 logger.error(f"Invalid cron expression for experiment {experiment.name}: {e}")
                 # Default to hourly if invalid
                 trigger = CronTrigger(hour='*')
+            
+            # Keep recurring experiments from all firing in the same second
+            offset = spread_offset(experiment.id, trigger) if experiment.spread else 0
+            if experiment.jitter:
+                trigger.jitter = experiment.jitter
+            if offset:
+                trigger = OffsetTrigger(trigger, offset)
         else:
             logger.error(f"Unknown schedule type for experiment {experiment.name}: {experiment.schedule_type}")
             return None
         
         # Add job to scheduler
-        job_id = f"experiment_{experiment.id}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
+        job_id = self.job_id_for(experiment.id)
         
         self.scheduler.add_job(
-            chaos_manager.execute_experiment,
+            run_experiment,
             trigger=trigger,
-            args=[experiment],
+            args=[experiment.id],
             id=job_id,
             name=experiment.name,
             replace_existing=True
@@ -95,9 +474,100 @@ class ChaosScheduler:
         logger.info(f"Scheduled experiment {experiment.name} with job ID {job_id}")
         return job_id
     
+    def _on_job_event(self, event):
+        # Runs on scheduler threads; the election thread writes the changes
+        experiment_id = self.experiment_id_for(event.job_id)
+        if experiment_id is not None:
+            with self._dirty_lock:
+                self._dirty.add(experiment_id)
+    
+    def _sync_next_run_times(self):
+        with self._dirty_lock:
+            experiment_ids, self._dirty = self._dirty, set()
+        if not experiment_ids:
+            return
+        
+        now = datetime.now(timezone.utc)
+        rows = []
+        for experiment_id in experiment_ids:
+            job = self.scheduler.get_job(self.job_id_for(experiment_id))
+            next_run_time = job.next_run_time if job else None
+            if next_run_time is not None and next_run_time <= now:
+                # Submitted but the job store isn't updated yet; look again next poll
+                with self._dirty_lock:
+                    self._dirty.add(experiment_id)
+                continue
+            rows.append({'id': experiment_id, 'next_run_time': _utc_naive(next_run_time)})
+        
+        self._write_next_run_times(rows)
+    
+    @staticmethod
+    def _write_next_run_times(rows):
+        if not rows:
+            return
+        # Experiments may have been deleted since; update only those that remain
+        existing = {
+            experiment_id for (experiment_id,) in db.session.query(Experiment.id)
+            .filter(Experiment.id.in_([row['id'] for row in rows]))
+        }
+        rows = [row for row in rows if row['id'] in existing]
+        if rows:
+            db.session.execute(update(Experiment), rows)
+        db.session.commit()
+    
+    def reconcile(self):
+        """
+        Make the job store match the active experiments (leader only)
+        
+        Removes jobs of deleted or inactive experiments and duplicates under
+        older job IDs, and recreates missing jobs. One-time experiments whose
+        time has passed are not recreated, since their job already fired.
+        """
+        self._last_reconcile = time.monotonic()
+        
+        jobs_by_experiment = {}
+        for job in self.scheduler.get_jobs():
+            if job.id in MAINTENANCE_JOB_IDS:
+                continue
+            experiment_id = job.args[0] if job.func is run_experiment and job.args else None
+            jobs_by_experiment.setdefault(experiment_id, []).append(job.id)
+        
+        experiments = {experiment.id: experiment for experiment in Experiment.query.filter_by(active=True)}
+        
+        removed = 0
+        for experiment_id, job_ids in jobs_by_experiment.items():
+            for job_id in job_ids:
+                if experiment_id not in experiments or job_id != self.job_id_for(experiment_id):
+                    removed += self.remove_job(job_id)
+        
+        added = 0
+        now = datetime.utcnow()
+        for experiment in experiments.values():
+            if self.job_id_for(experiment.id) in jobs_by_experiment.get(experiment.id, []):
+                continue
+            if experiment.schedule_type == 'one_time' and (
+                experiment.scheduled_time is None or experiment.scheduled_time <= now
+            ):
+                continue
+            added += self._add_job(experiment) is not None
+        
+        if removed or added:
+            logger.info(f"Reconciled scheduler jobs: {added} added, {removed} removed")
+        
+        # Rewrite every stored next run time from the job store
+        next_run_times = {
+            self.experiment_id_for(job.id): job.next_run_time for job in self.scheduler.get_jobs()
+        }
+        stale = db.session.query(Experiment.id).filter(Experiment.next_run_time.isnot(None))
+        experiment_ids = set(experiments) | {experiment_id for (experiment_id,) in stale}
+        self._write_next_run_times([
+            {'id': experiment_id, 'next_run_time': _utc_naive(next_run_times.get(experiment_id))}
+            for experiment_id in experiment_ids
+        ])
+    
     def remove_job(self, job_id):
         """
-        Remove a scheduled job
+        Remove a scheduled job (leader only)
         
         Args:
             job_id: ID of the job to remove
@@ -105,7 +575,9 @@ class ChaosScheduler:
         Returns:
             bool: True if job was removed, False otherwise
         """
-        if not job_id:
+        if not job_id or not self.is_leader:
+            return False
+        if self.scheduler.get_job(job_id) is None:
             return False
             
         try:
@@ -121,11 +593,26 @@ class ChaosScheduler:
         Get all scheduled jobs
         
         Returns:
-            list: List of jobs
+            list: List of jobs, empty unless this process is the leader
         """
+        if not self.is_leader:
+            return []
         return self.scheduler.get_jobs()
     
     def shutdown(self):
-        """Shutdown the scheduler"""
-        self.scheduler.shutdown()
+        """Shutdown the scheduler and hand the lease to the next process"""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        was_leader = self.is_leader
+        self._step_down()
+        
+        if was_leader and self._app is not None:
+            with self._app.app_context():
+                try:
+                    self._release_lease()
+                except Exception as e:
+                    logger.error(f"Error releasing scheduler lease: {str(e)}")
+                finally:
+                    db.session.remove()
         logger.info("Chaos scheduler shutdown")
@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# Applied to every new SQLite connection
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',        # readers never block the writer (or each other)
+    'synchronous': 'NORMAL',      # fsync at checkpoints only; safe with WAL
+    'busy_timeout': 5000,         # ms to wait for another process's write lock
+    'cache_size': -64000,         # 64 MiB page cache (negative = KiB)
+    'mmap_size': 268435456,       # 256 MiB memory-mapped reads
+    'temp_store': 'MEMORY',
+}
+
+class WriteGateTimeout(RuntimeError):
+    """Raised when a session waits too long to become the process's writer"""
+
+
+class WriteGate:
+    """
+    Serializes write transactions within the process.
+    
+    SQLite allows a single writer. When many threads write at once, they
+    spin in SQLite's busy handler. A transaction that read first and then
+    tries to write fails immediately with 'database is locked', because
+    SQLite cannot upgrade its snapshot. The gate makes sessions queue for
+    the write lock in Python before their first write reaches SQLite: the
+    first flush or DML statement of a transaction takes the gate, and the
+    end of the transaction (commit, rollback or close) releases it. Reads
+    never take the gate and stay fully concurrent under WAL.
+    
+    Other processes are still arbitrated by SQLite's busy_timeout.
+    """
+    
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._lock = threading.Lock()
+    
+    def install(self):
+        """Hook the gate into every ORM session"""
+        event.listen(Session, 'before_flush', self._before_flush)
+        event.listen(Session, 'do_orm_execute', self._do_orm_execute)
+        event.listen(Session, 'after_transaction_end', self._after_transaction_end)
+    
+    def acquire(self, session):
+        if session.info.get('write_gate'):
+            return
+        started = time.monotonic()
+        if not self._lock.acquire(timeout=self.timeout):
+            raise WriteGateTimeout(f"Timed out after {self.timeout}s waiting for the database write lock")
+        waited = time.monotonic() - started
+        
+        session.info['write_gate'] = True
+        self.waits += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+    
+    def release(self, session):
+        if session.info.pop('write_gate', False):
+            self._lock.release()
+    
+    def stats(self):
+        """
+        Returns:
+            dict: Number of gated transactions and their wait times in seconds
+        """
+        return {
+            'waits': self.waits,
+            'wait_avg': self.wait_total / self.waits if self.waits else 0.0,
+            'wait_max': self.wait_max,
+            'held': self._lock.locked()
+        }
+    
+    def _before_flush(self, session, flush_context, instances):
+        self.acquire(session)
+    
+    def _do_orm_execute(self, orm_execute_state):
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            self.acquire(orm_execute_state.session)
+    
+    def _after_transaction_end(self, session, transaction):
+        # Only the outermost transaction ends the write
+        if transaction.parent is None:
+            self.release(session)
+
+
+# Process-wide gate; installed only for SQLite databases
+write_gate = WriteGate()
+
+
+def configure_sqlite(db):
+    """
+    Apply SQLite pragmas to new connections and install the write gate
+    
+    Does nothing for other databases. Must run before the engine's first
+    connection is made.
+    
+    Args:
+        db: Flask-SQLAlchemy instance (inside an app context)
+        
+    Returns:
+        bool: True if the database is SQLite and was configured
+    """
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return False
+    
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+    
+    write_gate.install()
+    logger.info("SQLite configured for WAL with a serialized write path")
+    return True
@@ -1,20 +1,635 @@
 import io
+import os
 import paramiko
 import logging
 import socket
+import select
 import time
+import datetime
+import errno
+import hashlib
+import threading
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from sqlalchemy import event, inspect
+from models import Server
 
 logger = logging.getLogger(__name__)
 
+class SSHConnectionPool:
+    """
+    Thread-safe pool of shared SSH transports, one per server.
+    
+    Shared by the Flask request handlers and the APScheduler worker threads so
+    that repeated actions and status polls against the same server reuse an
+    open transport instead of paying for a new TCP + key exchange + auth
+    handshake every time.
+    
+    Concurrent users of the same server are multiplexed as separate channels
+    over a single transport. At most max_channels_per_host channels are open
+    per server; further callers wait in FIFO order for a free slot, so sshd
+    on the target sees one connection however dense the experiment window.
+    """
+    
+    def __init__(self, max_channels_per_host=8, idle_timeout=120, max_age=900,
+                 keepalive_interval=30, sweep_interval=30, slot_timeout=300,
+                 connect_retry_delay=2):
+        self.max_channels_per_host = max_channels_per_host
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self.keepalive_interval = keepalive_interval
+        self.sweep_interval = sweep_interval
+        self.slot_timeout = slot_timeout
+        self.connect_retry_delay = connect_retry_delay
+        
+        self._lock = threading.Lock()
+        self._hosts = {}  # pool key -> _HostSlots
+        self._leases = {}  # id(client) -> (_HostSlots, _SharedClient)
+        self._last_sweep = time.monotonic()
+    
+    @staticmethod
+    def pool_key(server):
+        """
+        Build the pool key for a server
+        
+        The key includes a digest of the credentials so that editing the
+        server row (new key, password or address) never hands out a client
+        authenticated with the old details.
+        
+        Args:
+            server: Server object
+            
+        Returns:
+            tuple: Hashable pool key
+        """
+        credentials = hashlib.sha256()
+        credentials.update(b'key' if server.use_key_auth else b'password')
+        credentials.update((server.ssh_key or '').encode('utf-8'))
+        credentials.update(b'\0')
+        credentials.update((server.password or '').encode('utf-8'))
+        return (server.id, server.hostname, server.port, server.username, credentials.hexdigest())
+    
+    def acquire(self, server, connect, timeout=None):
+        """
+        Get a channel slot on the server's shared client, connecting if needed
+        
+        Every successful acquire must be paired with one release.
+        
+        Args:
+            server: Server object
+            connect: Callable creating a new connected client for the server
+            timeout: Seconds to wait for a free channel slot (defaults to slot_timeout)
+            
+        Returns:
+            tuple: (paramiko.SSHClient, bool reused)
+            
+        Raises:
+            TimeoutError: If no channel slot frees up in time
+        """
+        key = self.pool_key(server)
+        self._maybe_sweep()
+        
+        host = self._take_slot(key, server, self.slot_timeout if timeout is None else timeout)
+        
+        try:
+            # One handshake per host: later slot holders wait for it and share it
+            with host.connect_lock:
+                with self._lock:
+                    shared = host.shared
+                    if shared is not None and self._is_usable(shared):
+                        shared.users += 1
+                        shared.last_used = time.monotonic()
+                        return shared.client, True
+                    if shared is not None:
+                        self._retire(host, shared)
+                    failed_recently = (
+                        host.last_error is not None
+                        and time.monotonic() - host.failed_at < self.connect_retry_delay
+                    )
+                
+                if failed_recently:
+                    raise host.last_error
+                
+                try:
+                    client = connect(server)
+                except Exception as e:
+                    host.last_error = e
+                    host.failed_at = time.monotonic()
+                    raise
+                
+                transport = client.get_transport()
+                if transport is not None and self.keepalive_interval:
+                    transport.set_keepalive(self.keepalive_interval)
+                
+                with self._lock:
+                    host.last_error = None
+                    shared = host.shared = _SharedClient(client)
+                    shared.users = 1
+                    self._leases[id(client)] = (host, shared)
+                return client, False
+        except BaseException:
+            with self._lock:
+                self._give_slot(host)
+            raise
+    
+    def release(self, server, client, discard=False):
+        """
+        Give back a channel slot taken with acquire
+        
+        Args:
+            server: Server object the client was acquired for
+            client: paramiko.SSHClient returned by acquire
+            discard: Stop handing out this client; it is closed once no other
+                     channel is still using it
+        """
+        to_close = None
+        with self._lock:
+            lease = self._leases.get(id(client))
+            if lease is None:
+                to_close = client
+            else:
+                host, shared = lease
+                shared.users -= 1
+                shared.last_used = time.monotonic()
+                
+                # Unsaved servers (e.g. connection tests before insert) are never pooled
+                if discard or server.id is None or not self._is_usable(shared):
+                    self._retire(host, shared)
+                if shared.retired and shared.users == 0:
+                    self._leases.pop(id(client), None)
+                    to_close = client
+                self._give_slot(host)
+        
+        if to_close is not None:
+            self._close(to_close)
+    
+    @contextmanager
+    def connection(self, server, connect):
+        """
+        Context manager yielding a pooled client
+        
+        The client is retired instead of kept for reuse if the body raises,
+        since the transport state is then unknown.
+        
+        Args:
+            server: Server object
+            connect: Callable creating a new connected client for the server
+        """
+        client, _ = self.acquire(server, connect)
+        try:
+            yield client
+        except BaseException:
+            self.release(server, client, discard=True)
+            raise
+        else:
+            self.release(server, client)
+    
+    def invalidate(self, server_id):
+        """
+        Retire every shared client held for a server
+        
+        Clients with channels still open are closed when the last one is released.
+        
+        Args:
+            server_id: ID of the Server row
+        """
+        with self._lock:
+            hosts = [host for key, host in self._hosts.items() if key[0] == server_id]
+            stale = [self._retire(host, host.shared) for host in hosts if host.shared is not None]
+        for client in stale:
+            if client is not None:
+                self._close(client)
+    
+    def evict_idle(self):
+        """Close unused clients that exceeded their idle timeout or max age"""
+        stale = []
+        with self._lock:
+            for key in list(self._hosts):
+                host = self._hosts[key]
+                shared = host.shared
+                if shared is not None and shared.users == 0 and not self._is_usable(shared):
+                    stale.append(self._retire(host, shared))
+                if host.shared is None and host.in_use == 0 and not host.waiters:
+                    del self._hosts[key]
+            self._last_sweep = time.monotonic()
+        for client in stale:
+            if client is not None:
+                self._close(client)
+    
+    def close_all(self):
+        """Retire every shared client, closing those with no open channels"""
+        with self._lock:
+            stale = [self._retire(host, host.shared) for host in self._hosts.values() if host.shared is not None]
+        for client in stale:
+            if client is not None:
+                self._close(client)
+    
+    def stats(self):
+        """
+        Snapshot of channel usage per server
+        
+        Returns:
+            dict: pool key -> {'channels': int, 'waiting': int, 'connected': bool}
+        """
+        with self._lock:
+            return {
+                key: {
+                    'channels': host.in_use,
+                    'waiting': len(host.waiters),
+                    'connected': host.shared is not None
+                }
+                for key, host in self._hosts.items()
+            }
+    
+    def _take_slot(self, key, server, timeout):
+        """Take (or queue for) a channel slot on the host for key; returns its _HostSlots"""
+        # Look up the host and claim the slot (or a place in the queue) under one
+        # lock hold: evict_idle only drops hosts with no slots in use and no
+        # waiters, so the entry cannot be orphaned in between
+        with self._lock:
+            host = self._hosts.get(key)
+            if host is None:
+                host = self._hosts[key] = _HostSlots()
+            if host.in_use < self.max_channels_per_host and not host.waiters:
+                host.in_use += 1
+                return host
+            ticket = threading.Event()
+            host.waiters.append(ticket)
+        
+        if ticket.wait(timeout):
+            return host
+        
+        with self._lock:
+            # The slot may have been handed over just as the wait timed out
+            if ticket.is_set():
+                return host
+            host.waiters.remove(ticket)
+        raise TimeoutError(f"No free SSH channel to {server.hostname} after {timeout}s")
+    
+    def _give_slot(self, host):
+        # Called with self._lock held; hand the slot straight to the oldest waiter
+        if host.waiters:
+            host.waiters.popleft().set()
+        else:
+            host.in_use -= 1
+    
+    def _retire(self, host, shared):
+        """Stop handing out a shared client; returns it if it can be closed now"""
+        # Called with self._lock held
+        shared.retired = True
+        if host.shared is shared:
+            host.shared = None
+        if shared.users == 0:
+            self._leases.pop(id(shared.client), None)
+            return shared.client
+        return None
+    
+    def _maybe_sweep(self):
+        if time.monotonic() - self._last_sweep >= self.sweep_interval:
+            self.evict_idle()
+    
+    def _is_usable(self, shared):
+        if shared.retired:
+            return False
+        now = time.monotonic()
+        if self.max_age and now - shared.created_at > self.max_age:
+            return False
+        if self.idle_timeout and shared.users == 0 and now - shared.last_used > self.idle_timeout:
+            return False
+        transport = shared.client.get_transport()
+        return transport is not None and transport.is_active()
+    
+    @staticmethod
+    def _close(client):
+        try:
+            client.close()
+        except Exception as e:
+            logger.debug(f"Error closing pooled SSH client: {str(e)}")
+
+
+class _HostSlots:
+    __slots__ = ('shared', 'in_use', 'waiters', 'connect_lock', 'last_error', 'failed_at')
+    
+    def __init__(self):
+        self.shared = None
+        self.in_use = 0
+        self.waiters = deque()
+        self.connect_lock = threading.Lock()
+        self.last_error = None
+        self.failed_at = 0
+
+
+class _SharedClient:
+    __slots__ = ('client', 'created_at', 'last_used', 'users', 'retired')
+    
+    def __init__(self, client):
+        self.client = client
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.users = 0
+        self.retired = False
+
+
+class PrivateKeyCache:
+    """
+    Process-wide LRU cache of parsed private keys.
+    
+    Entries are keyed by a SHA-256 digest of the PEM text stored in
+    Server.ssh_key, so identical keys shared by many servers are parsed once.
+    The key type (Ed25519, ECDSA, RSA) is detected on first load.
+    """
+    
+    KEY_CLASSES = tuple(
+        key_class for key_class in (
+            getattr(paramiko, 'Ed25519Key', None),
+            getattr(paramiko, 'ECDSAKey', None),
+            getattr(paramiko, 'RSAKey', None),
+            getattr(paramiko, 'DSSKey', None),
+        ) if key_class is not None
+    )
+    
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._keys = OrderedDict()  # digest -> paramiko.PKey
+        self._server_digests = {}  # server id -> digest last loaded for it
+    
+    @staticmethod
+    def digest(key_material):
+        return hashlib.sha256(key_material.encode('utf-8')).hexdigest()
+    
+    def load(self, server):
+        """
+        Get the parsed private key for a server, parsing it only on a cache miss
+        
+        Args:
+            server: Server object with ssh_key set
+            
+        Returns:
+            paramiko.PKey
+        """
+        digest = self.digest(server.ssh_key)
+        
+        with self._lock:
+            previous = self._server_digests.get(server.id)
+            if server.id is not None and previous != digest:
+                # The server's key changed since it was last loaded
+                if previous is not None:
+                    self._keys.pop(previous, None)
+                self._server_digests[server.id] = digest
+            
+            pkey = self._keys.get(digest)
+            if pkey is not None:
+                self._keys.move_to_end(digest)
+                return pkey
+        
+        pkey = self.parse(server.ssh_key)
+        
+        with self._lock:
+            self._keys[digest] = pkey
+            self._keys.move_to_end(digest)
+            while len(self._keys) > self.max_entries:
+                self._keys.popitem(last=False)
+        return pkey
+    
+    @classmethod
+    def parse(cls, key_material):
+        """
+        Parse PEM/OpenSSH private key text, auto-detecting the key type
+        
+        Args:
+            key_material: Private key text
+            
+        Returns:
+            paramiko.PKey
+            
+        Raises:
+            paramiko.SSHException: If no supported key type can parse the key
+        """
+        errors = []
+        for key_class in cls.KEY_CLASSES:
+            try:
+                return key_class.from_private_key(io.StringIO(key_material))
+            except (paramiko.SSHException, ValueError, TypeError) as e:
+                errors.append(f"{key_class.__name__}: {str(e)}")
+        raise paramiko.SSHException(f"Unsupported or invalid private key ({'; '.join(errors)})")
+    
+    def invalidate(self, server_id):
+        """
+        Drop the cached key last loaded for a server
+        
+        Args:
+            server_id: ID of the Server row
+        """
+        with self._lock:
+            digest = self._server_digests.pop(server_id, None)
+            if digest is not None:
+                self._keys.pop(digest, None)
+    
+    def clear(self):
+        """Drop every cached key"""
+        with self._lock:
+            self._keys.clear()
+            self._server_digests.clear()
+
+
+class CommandStream:
+    """
+    Iterator over the interleaved stdout/stderr of a running remote command.
+    
+    Both streams are drained as data arrives, so a chatty command can never
+    block on a full stderr window. Memory use is bounded: chunks past
+    max_bytes are read and discarded (only counted), while the last
+    tail_bytes of combined output are always kept for logging. A wall-clock
+    timeout closes the channel so a stuck command cannot hold the caller.
+    
+    Iterating yields ('stdout' | 'stderr', bytes) tuples. After iteration
+    finishes, exit_status, timed_out, truncated and tail() describe the run.
+    """
+    
+    def __init__(self, channel, max_bytes=None, timeout=None, tail_bytes=4096,
+                 chunk_size=32768, poll_interval=0.1, on_close=None):
+        self.channel = channel
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.tail_bytes = tail_bytes
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+        self.on_close = on_close
+        
+        self.exit_status = None
+        self.timed_out = False
+        self.truncated = False
+        self.bytes_read = 0
+        self.started = time.monotonic()
+        self.elapsed = None
+        self._tail = bytearray()
+        self._closed = False
+    
+    def __iter__(self):
+        deadline = self.started + self.timeout if self.timeout else None
+        channel = self.channel
+        
+        try:
+            while True:
+                got_data = False
+                
+                while channel.recv_ready():
+                    chunk = channel.recv(self.chunk_size)
+                    if not chunk:
+                        break
+                    got_data = True
+                    if self._accept(chunk):
+                        yield 'stdout', chunk
+                
+                while channel.recv_stderr_ready():
+                    chunk = channel.recv_stderr(self.chunk_size)
+                    if not chunk:
+                        break
+                    got_data = True
+                    if self._accept(chunk):
+                        yield 'stderr', chunk
+                
+                if not got_data:
+                    if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+                        self.exit_status = channel.recv_exit_status()
+                        break
+                    if deadline is not None and time.monotonic() >= deadline:
+                        self.timed_out = True
+                        logger.warning(f"Remote command timed out after {self.timeout}s, closing channel")
+                        break
+                    wait = self.poll_interval
+                    if deadline is not None:
+                        wait = max(0, min(wait, deadline - time.monotonic()))
+                    select.select([channel], [], [], wait)
+        finally:
+            self.close()
+    
+    def _accept(self, chunk):
+        """Record a chunk in the tail buffer; return whether it is within the byte cap"""
+        self._tail.extend(chunk)
+        if len(self._tail) > self.tail_bytes:
+            del self._tail[:len(self._tail) - self.tail_bytes]
+        
+        within_cap = self.max_bytes is None or self.bytes_read < self.max_bytes
+        self.bytes_read += len(chunk)
+        if not within_cap:
+            self.truncated = True
+        return within_cap
+    
+    def tail(self):
+        """
+        Last tail_bytes of combined output, decoded for ExperimentLog.details
+        
+        Returns:
+            str
+        """
+        return self._tail.decode('utf-8', errors='replace')
+    
+    def close(self):
+        """Close the channel and hand the connection back to its owner"""
+        if self._closed:
+            return
+        self._closed = True
+        self.elapsed = time.monotonic() - self.started
+        try:
+            self.channel.close()
+        except Exception as e:
+            logger.debug(f"Error closing SSH channel: {str(e)}")
+        if self.on_close:
+            self.on_close(self)
+
+
+# Process-wide pool and key cache shared by every SSHManager instance
+connection_pool = SSHConnectionPool()
+key_cache = PrivateKeyCache()
+
+# Last probe result per server id, adding latencies to cached Server.status hits
+probe_results = {}
+
+def invalidate_server(server_id):
+    """
+    Forget pooled connections and cached keys for a server
+    
+    Called when a Server row is edited or deleted.
+    
+    Args:
+        server_id: ID of the Server row
+    """
+    connection_pool.invalidate(server_id)
+    key_cache.invalidate(server_id)
+    probe_results.pop(server_id, None)
+
+# Columns that affect how a server is reached; status updates do not count
+CONNECTION_COLUMNS = ('hostname', 'port', 'username', 'password', 'ssh_key', 'use_key_auth')
+
+@event.listens_for(Server, 'after_update')
+def _server_updated(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[column].history.has_changes() for column in CONNECTION_COLUMNS):
+        invalidate_server(target.id)
+
+@event.listens_for(Server, 'after_delete')
+def _server_deleted(mapper, connection, target):
+    invalidate_server(target.id)
+
+# Detached copy of the Server columns needed to connect. Batch operations hand
+# these to worker threads instead of ORM instances, which must not be
+# lazy-loaded from threads other than the one owning their session.
+ServerTarget = namedtuple('ServerTarget', [
+    'id', 'name', 'hostname', 'port', 'username', 'password', 'ssh_key', 'use_key_auth'
+])
+
+def server_target(server):
+    """
+    Snapshot the connection details of a Server row
+    
+    Args:
+        server: Server object (or ServerTarget)
+        
+    Returns:
+        ServerTarget
+    """
+    if isinstance(server, ServerTarget):
+        return server
+    return ServerTarget(
+        id=server.id,
+        name=server.name,
+        hostname=server.hostname,
+        port=server.port,
+        username=server.username,
+        password=server.password,
+        ssh_key=server.ssh_key,
+        use_key_auth=server.use_key_auth
+    )
+
 class SSHManager:
     """
     Manager for SSH connections to remote servers
     """
     
-    def __init__(self):
+    # Default bound on concurrent hosts for batch operations
+    max_batch_workers = 64
+    
+    # Defaults for execute_command: commands still running after command_timeout
+    # seconds are abandoned and their channel closed
+    command_timeout = 300
+    max_output_bytes = 1024 * 1024
+    
+    # Health probing: tiers in increasing cost, per-tier timeout and how long
+    # a stored Server.status is trusted before probing again
+    PROBE_LEVELS = ('tcp', 'banner', 'auth')
+    probe_timeout = 3
+    status_ttl = 30
+    
+    def __init__(self, pool=None, keys=None, connect_timeout=10):
         # Increase paramiko logging level to suppress verbose logs
         paramiko_logger = logging.getLogger("paramiko")
         paramiko_logger.setLevel(logging.WARNING)
+        self.pool = pool or connection_pool
+        self.keys = keys or key_cache
+        self.connect_timeout = connect_timeout
     
     def get_ssh_client(self, server):
         """
@@ -32,13 +647,13 @@ class SSHManager:
         try:
             if server.use_key_auth and server.ssh_key:
                 # Use private key authentication
-                private_key = paramiko.RSAKey.from_private_key(io.StringIO(server.ssh_key))
+                private_key = self.keys.load(server)
                 client.connect(
                     hostname=server.hostname,
                     port=server.port,
                     username=server.username,
                     pkey=private_key,
-                    timeout=10
+                    timeout=self.connect_timeout
                 )
             else:
                 # Use password authentication
@@ -47,7 +662,7 @@ class SSHManager:
                     port=server.port,
                     username=server.username,
                     password=server.password,
-                    timeout=10
+                    timeout=self.connect_timeout
                 )
                 
             return client
@@ -67,51 +682,129 @@ class SSHManager:
             bool: True if connection successful, False otherwise
         """
         try:
-            client = self.get_ssh_client(server)
-            client.close()
+            with self.pool.connection(server, self.get_ssh_client):
+                pass
             return True
         except Exception as e:
             logger.error(f"Failed to connect to {server.hostname}: {str(e)}")
             return False
     
-    def execute_command(self, server, command):
+    def open_channel(self, server, command):
+        """
+        Start a command on a pooled connection
+        
+        Args:
+            server: Server object
+            command: Command to execute
+            
+        Returns:
+            tuple: (paramiko.SSHClient, paramiko.Channel) - release the client
+                   back to the pool once the channel is finished with
+        """
+        client, reused = self.pool.acquire(server, self.get_ssh_client)
+        try:
+            return client, self._exec_on(client, command)
+        except (paramiko.SSHException, EOFError, socket.error) as e:
+            self.pool.release(server, client, discard=True)
+            if not reused:
+                raise
+            # The pooled transport died since it was last used; reconnect once
+            logger.debug(f"Stale SSH transport to {server.hostname}, reconnecting: {str(e)}")
+        
+        client, _ = self.pool.acquire(server, self.get_ssh_client)
+        try:
+            return client, self._exec_on(client, command)
+        except Exception:
+            self.pool.release(server, client, discard=True)
+            raise
+    
+    @staticmethod
+    def _exec_on(client, command):
+        channel = client.get_transport().open_session()
+        channel.exec_command(command)
+        return channel
+    
+    def stream_command(self, server, command, max_bytes=None, timeout=None, tail_bytes=4096):
+        """
+        Execute a command and stream its output as it is produced
+        
+        Args:
+            server: Server object
+            command: Command to execute
+            max_bytes: Stop yielding output after this many bytes (the rest is
+                       drained and discarded)
+            timeout: Wall-clock seconds before the channel is closed
+            tail_bytes: Size of the combined output tail kept for logging
+            
+        Returns:
+            CommandStream: Iterable of ('stdout' | 'stderr', bytes) chunks
+        """
+        client, channel = self.open_channel(server, command)
+        
+        def release(stream):
+            self.pool.release(server, client, discard=stream.exit_status is None and not stream.timed_out)
+        
+        return CommandStream(channel, max_bytes=max_bytes, timeout=timeout,
+                             tail_bytes=tail_bytes, on_close=release)
+    
+    def execute_command(self, server, command, timeout=None, max_output_bytes=None):
         """
         Execute a command on a remote server
         
         Args:
             server: Server object
             command: Command to execute
+            timeout: Wall-clock seconds before the command is abandoned
+                     (defaults to command_timeout)
+            max_output_bytes: Cap on captured stdout+stderr
+                              (defaults to max_output_bytes)
             
         Returns:
-            dict: {'success': bool, 'output': str, 'error': str}
+            dict: {'success': bool, 'output': str, 'error': str, 'message': str,
+                   'exit_status': int, 'timed_out': bool, 'truncated': bool}
         """
         try:
-            client = self.get_ssh_client(server)
-            stdin, stdout, stderr = client.exec_command(command)
-            exit_status = stdout.channel.recv_exit_status()
+            stream = self.stream_command(
+                server,
+                command,
+                max_bytes=max_output_bytes or self.max_output_bytes,
+                timeout=timeout or self.command_timeout
+            )
             
-            output = stdout.read().decode('utf-8')
-            error = stderr.read().decode('utf-8')
+            output = bytearray()
+            error = bytearray()
+            for name, chunk in stream:
+                (output if name == 'stdout' else error).extend(chunk)
             
-            client.close()
+            output = output.decode('utf-8', errors='replace')
+            error = error.decode('utf-8', errors='replace')
+            
+            if stream.timed_out:
+                message = f"Command timed out after {stream.timeout}s. Output tail:\n{stream.tail()}"
+            else:
+                message = output if stream.exit_status == 0 else error
             
             return {
-                'success': exit_status == 0,
+                'success': stream.exit_status == 0,
                 'output': output,
                 'error': error,
-                'message': output if exit_status == 0 else error
+                'message': message,
+                'exit_status': stream.exit_status,
+                'timed_out': stream.timed_out,
+                'truncated': stream.truncated
             }
             
         except Exception as e:
             logger.error(f"Command execution error on {server.hostname}: {str(e)}")
             return {'success': False, 'output': '', 'error': str(e), 'message': str(e)}
     
-    def shutdown_server(self, server):
+    def shutdown_server(self, server, timeout=None):
         """
         Shutdown a remote server
         
         Args:
             server: Server object
+            timeout: Wall-clock seconds allowed per command (defaults to command_timeout)
             
         Returns:
             dict: {'success': bool, 'message': str}
@@ -121,17 +814,19 @@ class SSHManager:
         shutdown_command = "sudo shutdown -h now"
         
         try:
-            result = self.execute_command(server, shutdown_command)
+            result = self.execute_command(server, shutdown_command, timeout=timeout)
             
             # If command executed successfully, the server will be shutting down
             if result['success']:
+                self.pool.invalidate(server.id)
                 return {'success': True, 'message': 'Shutdown command executed successfully'}
             else:
                 # Try an alternative command for non-sudo systems
                 alternative_command = "shutdown -h now"
-                result = self.execute_command(server, alternative_command)
+                result = self.execute_command(server, alternative_command, timeout=timeout)
                 
                 if result['success']:
+                    self.pool.invalidate(server.id)
                     return {'success': True, 'message': 'Shutdown command executed successfully'}
                 else:
                     return {'success': False, 'message': f"Failed to shutdown server: {result['error']}"}
@@ -145,12 +840,13 @@ class SSHManager:
             logger.error(f"Error shutting down server {server.hostname}: {str(e)}")
             return {'success': False, 'message': str(e)}
     
-    def reboot_server(self, server):
+    def reboot_server(self, server, timeout=None):
         """
         Reboot a remote server
         
         Args:
             server: Server object
+            timeout: Wall-clock seconds allowed per command (defaults to command_timeout)
             
         Returns:
             dict: {'success': bool, 'message': str}
@@ -160,17 +856,19 @@ class SSHManager:
         reboot_command = "sudo reboot"
         
         try:
-            result = self.execute_command(server, reboot_command)
+            result = self.execute_command(server, reboot_command, timeout=timeout)
             
             # If command executed successfully, the server will be rebooting
             if result['success']:
+                self.pool.invalidate(server.id)
                 return {'success': True, 'message': 'Reboot command executed successfully'}
             else:
                 # Try an alternative command for non-sudo systems
                 alternative_command = "reboot"
-                result = self.execute_command(server, alternative_command)
+                result = self.execute_command(server, alternative_command, timeout=timeout)
                 
                 if result['success']:
+                    self.pool.invalidate(server.id)
                     return {'success': True, 'message': 'Reboot command executed successfully'}
                 else:
                     return {'success': False, 'message': f"Failed to reboot server: {result['error']}"}
@@ -184,14 +882,267 @@ class SSHManager:
             logger.error(f"Error rebooting server {server.hostname}: {str(e)}")
             return {'success': False, 'message': str(e)}
     
-    def check_server_status(self, server):
+    def probe_server(self, server, level='banner', timeout=None):
+        """
+        Probe a server in tiers, stopping at the first failure
+        
+        Tiers, cheapest first:
+            'tcp'    - non-blocking connect to the SSH port
+            'banner' - read the SSH identification banner
+            'auth'   - full SSH login (uses the connection pool)
+        
+        Args:
+            server: Server object
+            level: Deepest tier to run ('tcp', 'banner' or 'auth')
+            timeout: Per-tier timeout in seconds (defaults to probe_timeout)
+            
+        Returns:
+            dict: {'status': 'online' | 'offline', 'level': str (last tier passed),
+                   'latency': {tier: milliseconds}, 'error': str | None}
+        """
+        if level not in self.PROBE_LEVELS:
+            raise ValueError(f"Unknown probe level: {level}")
+        timeout = timeout or self.probe_timeout
+        
+        result = {'status': 'offline', 'level': None, 'latency': {}, 'error': None}
+        sock = None
+        
+        try:
+            started = time.monotonic()
+            sock = self._tcp_connect(server.hostname, server.port, timeout)
+            result['latency']['tcp'] = round((time.monotonic() - started) * 1000, 2)
+            result['level'] = 'tcp'
+            
+            if level in ('banner', 'auth'):
+                started = time.monotonic()
+                banner = self._read_banner(sock, timeout)
+                result['latency']['banner'] = round((time.monotonic() - started) * 1000, 2)
+                result['level'] = 'banner'
+                result['banner'] = banner
+            
+            sock.close()
+            sock = None
+            
+            if level == 'auth':
+                started = time.monotonic()
+                if not self.test_connection(server):
+                    raise paramiko.SSHException('SSH authentication failed')
+                result['latency']['auth'] = round((time.monotonic() - started) * 1000, 2)
+                result['level'] = 'auth'
+            
+            result['status'] = 'online'
+            
+        except Exception as e:
+            result['error'] = str(e) or e.__class__.__name__
+            logger.debug(f"Probe of {server.hostname} failed after tier {result['level']}: {result['error']}")
+        finally:
+            if sock is not None:
+                sock.close()
+        
+        return result
+    
+    @staticmethod
+    def _tcp_connect(hostname, port, timeout):
+        """Connect without blocking past the timeout, returning the connected socket"""
+        family, socktype, proto, _, address = socket.getaddrinfo(
+            hostname, port, type=socket.SOCK_STREAM
+        )[0]
+        sock = socket.socket(family, socktype, proto)
+        try:
+            sock.setblocking(False)
+            code = sock.connect_ex(address)
+            if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                raise OSError(code, os.strerror(code))
+            
+            _, writable, _ = select.select([], [sock], [], timeout)
+            if not writable:
+                raise socket.timeout(f"TCP connect to {hostname}:{port} timed out")
+            
+            code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if code:
+                raise OSError(code, os.strerror(code))
+            return sock
+        except BaseException:
+            sock.close()
+            raise
+    
+    @staticmethod
+    def _read_banner(sock, timeout):
+        """Read the server's SSH identification line"""
+        deadline = time.monotonic() + timeout
+        data = b''
+        while b'\n' not in data and len(data) < 1024:
+            remaining = deadline - time.monotonic()
+            readable, _, _ = select.select([sock], [], [], max(0, remaining))
+            if not readable:
+                raise socket.timeout('Timed out waiting for SSH banner')
+            chunk = sock.recv(256)
+            if not chunk:
+                raise EOFError('Connection closed before SSH banner')
+            data += chunk
+        
+        # Servers may send other lines before the identification string
+        for line in data.splitlines():
+            if line.startswith(b'SSH-'):
+                return line.decode('ascii', errors='replace').strip()
+        raise paramiko.SSHException('No SSH banner received')
+    
+    def refresh_server_status(self, server, level='banner', ttl=None, force=False):
+        """
+        Update Server.status/last_check from a probe, unless the stored status is fresh
+        
+        The caller is responsible for committing the session.
+        
+        Args:
+            server: Server object
+            level: Deepest probe tier to run
+            ttl: Seconds a stored status stays valid (defaults to status_ttl)
+            force: Probe even if the stored status is still fresh
+            
+        Returns:
+            dict: probe_server result plus 'cached' (bool)
+        """
+        ttl = self.status_ttl if ttl is None else ttl
+        cached = self.cached_status(server, level, ttl)
+        if cached is not None and not force:
+            return cached
+        
+        result = self.probe_server(server, level)
+        self.record_probe(server, result, level)
+        return dict(result, cached=False)
+    
+    def cached_status(self, server, level='banner', ttl=None):
+        """
+        Return the stored status of a server if it is still within its TTL
+        
+        Works from Server.status, last_check and probe_level alone, so a
+        status stored by another process (or before a restart) is reused.
+        An online status only counts if it was probed at least as deep as
+        requested. Latencies are only available for probes run in this process.
+        
+        Args:
+            server: Server object
+            level: Probe tier the caller needs
+            ttl: Seconds a stored status stays valid (defaults to status_ttl)
+            
+        Returns:
+            dict or None
+        """
+        ttl = self.status_ttl if ttl is None else ttl
+        if not server.last_check or server.status not in ('online', 'offline'):
+            return None
+        if (datetime.datetime.utcnow() - server.last_check).total_seconds() >= ttl:
+            return None
+        if server.status == 'online' and (
+            server.probe_level not in self.PROBE_LEVELS
+            or self.PROBE_LEVELS.index(server.probe_level) < self.PROBE_LEVELS.index(level)
+        ):
+            return None
+        
+        # Details of the same probe, if it ran in this process
+        last = probe_results.get(server.id)
+        if last is not None and last['checked_at'] == server.last_check:
+            return dict(last['result'], cached=True)
+        return {
+            'status': server.status,
+            'level': server.probe_level,
+            'latency': {},
+            'error': None,
+            'cached': True
+        }
+    
+    @staticmethod
+    def record_probe(server, result, level=None):
+        """Store a probe result on the Server row and in the in-process probe cache"""
+        server.status = result['status']
+        server.last_check = datetime.datetime.utcnow()
+        server.probe_level = level or result['level'] or 'tcp'
+        if server.id is not None:
+            probe_results[server.id] = {
+                'checked_at': server.last_check,
+                'result': result
+            }
+    
+    def probe_servers(self, servers, level='banner', max_workers=None):
+        """
+        Probe many servers concurrently
+        
+        Args:
+            servers: Iterable of Server objects
+            level: Deepest probe tier to run
+            max_workers: Maximum number of hosts in flight at once
+            
+        Yields:
+            dict: Per-host probe_server result with timing, as each finishes
+        """
+        return self.run_batch(servers, lambda target: self.probe_server(target, level), max_workers)
+    
+    def check_server_status(self, server, level='banner'):
         """
         Check if a server is online
         
         Args:
             server: Server object
+            level: Deepest probe tier to run ('tcp', 'banner' or 'auth')
             
         Returns:
             bool: True if server is online, False otherwise
         """
-        return self.test_connection(server)
+        return self.probe_server(server, level)['status'] == 'online'
+    
+    def run_batch(self, servers, operation, max_workers=None):
+        """
+        Run a per-server operation across many servers concurrently
+        
+        Results are yielded as each host finishes, so callers can stream
+        progress instead of waiting for the slowest host.
+        
+        Args:
+            servers: Iterable of Server objects
+            operation: Callable taking a server and returning a result dict
+            max_workers: Maximum number of hosts in flight at once
+            
+        Yields:
+            dict: The operation's result plus 'server_id', 'server_name',
+                  'hostname' and 'elapsed' (seconds spent on that host)
+        """
+        targets = [server_target(server) for server in servers]
+        if not targets:
+            return
+        
+        workers = min(max_workers or self.max_batch_workers, len(targets))
+        
+        def timed(target):
+            started = time.monotonic()
+            try:
+                result = operation(target)
+            except Exception as e:
+                logger.error(f"Batch operation error on {target.hostname}: {str(e)}")
+                result = {'success': False, 'message': str(e)}
+            return dict(
+                result,
+                server_id=target.id,
+                server_name=target.name,
+                hostname=target.hostname,
+                elapsed=time.monotonic() - started
+            )
+        
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ssh-batch') as executor:
+            futures = [executor.submit(timed, target) for target in targets]
+            for future in as_completed(futures):
+                yield future.result()
+    
+    def execute_command_many(self, servers, command, max_workers=None, timeout=None):
+        """
+        Execute a command on many servers with bounded concurrency
+        
+        Args:
+            servers: Iterable of Server objects
+            command: Command to execute
+            max_workers: Maximum number of hosts in flight at once
+            timeout: Per-host command timeout in seconds (see execute_command)
+            
+        Yields:
+            dict: Per-host execute_command result with timing, as each finishes
+        """
+        return self.run_batch(servers, lambda target: self.execute_command(target, command, timeout), max_workers)
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class TargetLeaseRegistry:
+    """
+    Per-target leases for chaos actions, deduplicating identical requests.
+    
+    Every action on a server or container runs under a lease on that target,
+    so two faults never hit the same target at once:
+    
+    - A request for the same target and action as one already queued or
+      running joins it and shares its result instead of running again.
+    - A request for a different action on a busy target is either queued
+      behind it (FIFO, 'queue') or refused ('reject').
+    
+    Lives on the async engine's event loop; run() must be awaited there.
+    """
+    
+    POLICIES = ('queue', 'reject')
+    
+    def __init__(self, conflict_policy='queue', queue_timeout=600):
+        if conflict_policy not in self.POLICIES:
+            raise ValueError(f"Unknown conflict policy: {conflict_policy}")
+        self.conflict_policy = conflict_policy
+        self.queue_timeout = queue_timeout
+        
+        self._locks = {}  # (target_type, target_id) -> asyncio.Lock
+        self._tasks = {}  # (target_type, target_id, action) -> asyncio.Task
+        self._metrics = {
+            'executions': 0,
+            'deduplicated': 0,
+            'rejected': 0,
+            'timed_out': 0,
+            'lock_waits': 0,
+            'lock_wait_total': 0.0,
+            'lock_wait_max': 0.0,
+        }
+    
+    async def run(self, target_type, target_id, action, execute, conflict_policy=None):
+        """
+        Run an action under the target's lease
+        
+        Args:
+            target_type: 'server' or 'container'
+            target_id: ID of the target row
+            action: Action name; requests with the same name are deduplicated
+            execute: Zero-argument callable returning the action coroutine
+            conflict_policy: 'queue' or 'reject' (defaults to the registry's)
+            
+        Returns:
+            dict: The action's result. Callers that joined another request get
+                  a copy with 'deduplicated': True and no 'started_at'; refused
+                  or timed-out requests get {'success': False, ...}.
+        """
+        key = (target_type, target_id)
+        policy = conflict_policy or self.conflict_policy
+        
+        existing = self._tasks.get(key + (action,))
+        if existing is not None:
+            self._metrics['deduplicated'] += 1
+            logger.info(f"Joining in-flight {action} on {target_type} {target_id}")
+            result = await asyncio.shield(existing)
+            shared = {name: value for name, value in result.items() if name != 'started_at'}
+            shared['deduplicated'] = True
+            return shared
+        
+        busy_with = [name for (t_type, t_id, name) in self._tasks if (t_type, t_id) == key]
+        if busy_with and policy == 'reject':
+            self._metrics['rejected'] += 1
+            return {
+                'success': False,
+                'message': f'{target_type.capitalize()} {target_id} is busy with {busy_with[0]}',
+                'rejected': True
+            }
+        
+        task = asyncio.ensure_future(self._execute(key, action, execute))
+        self._tasks[key + (action,)] = task
+        task.add_done_callback(lambda done: self._forget(key, action, done))
+        return await asyncio.shield(task)
+    
+    def _forget(self, key, action, task):
+        if self._tasks.get(key + (action,)) is task:
+            del self._tasks[key + (action,)]
+        # Drop the lock once nothing else is queued on the target
+        if not any((t_type, t_id) == key for (t_type, t_id, _) in self._tasks):
+            self._locks.pop(key, None)
+    
+    async def _execute(self, key, action, execute):
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        requested = time.monotonic()
+        
+        try:
+            await asyncio.wait_for(lock.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._metrics['timed_out'] += 1
+            return {
+                'success': False,
+                'message': f'Timed out after {self.queue_timeout}s waiting for {key[0]} {key[1]}'
+            }
+        
+        try:
+            waited = time.monotonic() - requested
+            self._metrics['executions'] += 1
+            self._metrics['lock_waits'] += 1
+            self._metrics['lock_wait_total'] += waited
+            self._metrics['lock_wait_max'] = max(self._metrics['lock_wait_max'], waited)
+            if waited > 0.01:
+                logger.info(f"Waited {waited:.2f}s for lease on {key[0]} {key[1]} ({action})")
+            
+            result = await execute()
+            return dict(result, lock_wait=round(waited, 3))
+        finally:
+            lock.release()
+    
+    def metrics(self):
+        """
+        Snapshot of lease metrics
+        
+        Returns:
+            dict: Counters plus lock wait statistics (seconds) and the number
+                  of actions currently queued or running
+        """
+        metrics = dict(self._metrics)
+        waits = metrics['lock_waits']
+        metrics['lock_wait_avg'] = metrics['lock_wait_total'] / waits if waits else 0.0
+        metrics['in_flight'] = len(self._tasks)
+        return metrics
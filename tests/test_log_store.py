@@ -0,0 +1,99 @@
+"""
+COPY encoding tests for log_store
+
+The round-trip tests run against PostgreSQL when TEST_DATABASE_URL points at
+one (e.g. postgresql://postgres@localhost/chaos_test) and psycopg2 is
+installed; otherwise only the encoding checks run, against a throwaway
+SQLite database.
+"""
+import datetime
+import io
+import os
+import tempfile
+
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL', '')
+POSTGRES = TEST_DATABASE_URL.startswith(('postgresql://', 'postgres://'))
+
+# Configure the app before it is imported: no background services, and never
+# the development database
+os.environ['DATABASE_URL'] = TEST_DATABASE_URL if POSTGRES else \
+    'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ['SCHEDULER_ENABLED'] = 'false'
+os.environ['DOCKER_EVENTS_ENABLED'] = 'false'
+
+import pytest
+
+from app import app, db
+from log_store import COPY_THRESHOLD, _csv_value, insert_logs
+from models import ExperimentLog
+
+requires_postgres = pytest.mark.skipif(
+    not POSTGRES, reason='TEST_DATABASE_URL does not point at PostgreSQL'
+)
+
+
+def test_csv_value_encoding():
+    assert _csv_value(None) == ''
+    assert _csv_value('') == '""'
+    assert _csv_value(True) == 'true'
+    assert _csv_value(False) == 'false'
+    assert _csv_value(42) == '"42"'
+    assert _csv_value('say "hi", then\nleave') == '"say ""hi"", then\nleave"'
+    assert _csv_value(datetime.datetime(2024, 5, 1, 12, 30, 0, 250)) == '"2024-05-01 12:30:00.000250"'
+
+
+@pytest.fixture
+def pg_connection():
+    pytest.importorskip('psycopg2')
+    with app.app_context():
+        connection = db.session.connection()
+        yield connection
+        db.session.rollback()
+
+
+@requires_postgres
+def test_copy_null_empty_and_boolean_round_trip(pg_connection):
+    values = [(True, None), (False, ''), (None, 'a "quoted", multi\nline value')]
+
+    raw = pg_connection.connection.driver_connection
+    cursor = raw.cursor()
+    try:
+        cursor.execute('CREATE TEMP TABLE copy_check (position integer, flag boolean, note text)')
+        payload = ''.join(
+            ','.join((_csv_value(position), _csv_value(flag), _csv_value(note))) + '\n'
+            for position, (flag, note) in enumerate(values)
+        )
+        cursor.copy_expert('COPY copy_check (position, flag, note) FROM STDIN WITH (FORMAT csv)', io.StringIO(payload))
+        cursor.execute('SELECT flag, note FROM copy_check ORDER BY position')
+        assert cursor.fetchall() == values
+    finally:
+        cursor.close()
+
+
+@requires_postgres
+def test_insert_logs_copy_round_trip(pg_connection):
+    marker = f"copy-test-{datetime.datetime.utcnow().timestamp()}"
+    moment = datetime.datetime(2024, 5, 1, 12, 30, 0, 250)
+    rows = [
+        {
+            'experiment_id': None,
+            'target_type': 'server',
+            'target_id': index,
+            'target_name': marker,
+            'action': 'restart',
+            'status': 'success' if index % 2 else 'failure',
+            'details': [None, '', 'plain', 'comma, "quote"\nnewline'][index % 4],
+            'execution_time': moment,
+        }
+        for index in range(COPY_THRESHOLD)
+    ]
+
+    assert insert_logs(rows) == len(rows)
+
+    stored = db.session.query(ExperimentLog).filter_by(target_name=marker).order_by(ExperimentLog.target_id).all()
+    assert len(stored) == len(rows)
+    for row, log in zip(rows, stored):
+        assert log.details == row['details']
+        assert log.status == row['status']
+        assert log.execution_time == moment
+        assert log.recovery_status is None
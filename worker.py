@@ -0,0 +1,156 @@
+"""
+Experiment worker process
+
+Claims queued experiment runs from the database and executes them on the
+async chaos engine. Run as many workers as needed, on any node that can
+reach the database and the targets, with EXECUTION_QUEUE_ENABLED=true set
+for the scheduler so that fired experiments are queued:
+
+    python worker.py --concurrency 50
+"""
+import argparse
+import logging
+import math
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+
+# Workers only execute runs; scheduling and event streams stay with the web tier
+os.environ.setdefault('SCHEDULER_ENABLED', 'false')
+os.environ.setdefault('DOCKER_EVENTS_ENABLED', 'false')
+
+from app import app, db
+from async_engine import RunLogError
+from chaos_manager import ChaosManager
+from experiment_queue import run_queue
+
+logger = logging.getLogger(__name__)
+
+class ExperimentWorker:
+    """
+    Executes queued experiment runs under database leases
+    
+    Each poll the worker records finished runs, heartbeats the leases of
+    runs still in flight, returns expired leases (from crashed workers) to
+    the queue, and claims as many due runs as it has free slots, up to the
+    number its start-rate limit lets it start before the next poll. Runs
+    execute concurrently on ChaosManager's async engine, so a slot costs no
+    thread while the fault and any recovery wait are in progress.
+    """
+    
+    def __init__(self, queue=None, chaos_manager=None, concurrency=20, poll_interval=1,
+                 purge_interval=3600, drain_timeout=60, max_starts_per_second=None):
+        self.queue = queue or run_queue
+        self.chaos_manager = chaos_manager or ChaosManager()
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        if max_starts_per_second is None:
+            max_starts_per_second = app.config.get('SCHEDULER_MAX_STARTS_PER_SECOND')
+        self.max_starts_per_second = max_starts_per_second
+        self.heartbeat_interval = self.queue.lease_seconds / 3
+        self.purge_interval = purge_interval
+        self.drain_timeout = drain_timeout
+        
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._in_flight = {}  # lease token -> (ExperimentRun ID, Future)
+        self._stopped = threading.Event()
+        self._stopped_at = None
+        self._last_heartbeat = 0
+        self._last_purge = 0
+    
+    def run(self):
+        """Process runs until stop() is called and in-flight runs have drained"""
+        logger.info(f"Experiment worker {self.worker_id} started (concurrency {self.concurrency})")
+        
+        while True:
+            if self._stopped.is_set():
+                if not self._in_flight:
+                    break
+                if time.monotonic() - self._stopped_at > self.drain_timeout:
+                    logger.warning(f"Leaving {len(self._in_flight)} runs to be retried after their leases expire")
+                    break
+            
+            with app.app_context():
+                try:
+                    self._poll()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Worker poll failed: {str(e)}")
+                finally:
+                    db.session.remove()
+            time.sleep(self.poll_interval)
+        
+        logger.info(f"Experiment worker {self.worker_id} stopped")
+    
+    def stop(self):
+        """Stop claiming runs; run() returns once in-flight runs finish"""
+        if not self._stopped.is_set():
+            self._stopped_at = time.monotonic()
+            self._stopped.set()
+    
+    def _poll(self):
+        self._record_finished()
+        
+        now = time.monotonic()
+        if self._in_flight and now - self._last_heartbeat >= self.heartbeat_interval:
+            renewed = self.queue.heartbeat(self._in_flight)
+            if renewed < len(self._in_flight):
+                logger.warning(f"{len(self._in_flight) - renewed} leases were lost before their runs finished")
+            self._last_heartbeat = now
+        
+        self.queue.requeue_expired()
+        
+        if now - self._last_purge >= self.purge_interval:
+            self.queue.purge()
+            self._last_purge = now
+        
+        if not self._stopped.is_set():
+            self._claim()
+    
+    def _claim(self):
+        engine = self.chaos_manager.engine
+        limit = self.concurrency - len(self._in_flight)
+        if self.max_starts_per_second:
+            # Claim only what can start before the next poll (the engine's start
+            # limiter spaces them), leaving the rest of a burst to other workers
+            limit = min(limit, math.ceil(self.max_starts_per_second * self.poll_interval))
+        for run in self.queue.claim(self.worker_id, limit):
+            logger.info(f"Claimed run {run.id} of experiment {run.experiment_id} (attempt {run.attempts})")
+            future = engine.submit(engine.execute_experiment(run.experiment_id))
+            self._in_flight[run.lease_token] = (run.id, future)
+    
+    def _record_finished(self):
+        for token, (run_id, future) in list(self._in_flight.items()):
+            if not future.done():
+                continue
+            del self._in_flight[token]
+            
+            error = future.exception()
+            if isinstance(error, RunLogError):
+                # The fault was injected; retrying would inject it again
+                self.queue.complete(token, error=str(error))
+                logger.error(f"Run {run_id} completed without a log: {str(error)}")
+            elif error is not None:
+                status = self.queue.fail(token, str(error))
+                logger.error(f"Run {run_id} failed ({status}): {str(error)}")
+            elif not self.queue.complete(token, future.result()):
+                logger.warning(f"Run {run_id} finished after its lease was lost")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Execute queued chaos experiment runs')
+    parser.add_argument('--concurrency', type=int, default=20, help='Runs executed at once')
+    parser.add_argument('--poll-interval', type=float, default=1, help='Seconds between queue polls')
+    args = parser.parse_args()
+    
+    worker = ExperimentWorker(concurrency=args.concurrency, poll_interval=args.poll_interval)
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    signal.signal(signal.SIGINT, lambda *_: worker.stop())
+    worker.run()
+
+
+if __name__ == '__main__':
+    main()